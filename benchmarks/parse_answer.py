@@ -0,0 +1,82 @@
+import argparse
+import ast
+import contextlib
+import glob
+import io
+import json
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utils  # noqa: E402
+
+
+def legacy_parse_answer(answer):
+    """
+    utils.parse_answer before the single pass scanner, for comparison.
+    """
+    if 'json' in answer:
+        answer = str(answer[7:-3])
+    if 'python' in answer:
+        answer = str(answer[9:-3])
+    try:
+        return ast.literal_eval(answer)
+    except Exception:
+        input_text = answer
+        input_text = re.sub(r"'''(json|python)", "", input_text).strip("'''").strip()
+        try:
+            return json.loads(input_text)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return ast.literal_eval(input_text)
+        except (ValueError, SyntaxError):
+            pass
+        match = re.search(r"\[.*\]", input_text, re.DOTALL)
+        if match:
+            try:
+                return ast.literal_eval(match.group(0))
+            except (ValueError, SyntaxError):
+                pass
+        raise ValueError("No valid list found in the input")
+
+
+def responses(root=ROOT):
+    """
+    The recorded design responses, as saved, and as the model also answers them: surrounded by prose with brackets.
+    """
+    found = {}
+    for path in sorted(glob.glob(os.path.join(root, '**', 'generated_design.txt'), recursive=True)):
+        with open(path) as file:
+            text = file.read()
+        name = os.path.relpath(path, root)
+        found[name] = text
+        found[f'{name} with prose'] = (f"Here's the revised design [v2], with the changes (see below):\n\n{text}\n\n"
+                                       f"Each task's inputs are listed in [brackets] where it matters.")
+    return found
+
+
+def outcome(parse, text):
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = parse(text)
+        return f'list of {len(result)}' if isinstance(result, list) else type(result).__name__
+    except Exception as e:
+        return type(e).__name__
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare parse_answer with its previous version on recorded responses.")
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+    for name, text in responses().items():
+        timings = {}
+        for label, parse in (('legacy', legacy_parse_answer), ('scanner', utils.parse_answer)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = timeit.timeit(lambda: outcome(parse, text), number=args.number) / args.number
+            timings[label] = f'{seconds * 1e6:9.1f} us ({outcome(parse, text)})'
+        print(f'{name} [{len(text)} chars]\n    legacy  {timings["legacy"]}\n    scanner {timings["scanner"]}')
@@ -0,0 +1,52 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules of the pipeline, in the order they are usually imported
+MODULES = ['utils', 'static_checker', 'repair', 'profiling', 'generate_code', 'hierarchical', 'estimate', 'daemon',
+           'job_queue']
+
+
+def import_time(module, repeats=5):
+    """
+    Median wall time, in seconds, of importing the module in a fresh interpreter, minus that of the bare interpreter.
+    """
+    def run(code):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+    return run(f'import {module}') - run('pass')
+
+
+def slowest_imports(module, top=5):
+    """
+    The imports of the module taking the longest, cumulative microseconds, from python -X importtime.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stderr
+    found = []
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)", line)
+        if match:
+            found.append((int(match.group(1)), match.group(2)))
+    return sorted(found, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of the modules of the pipeline, each in a fresh process.")
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    # offline, without credentials: importing must not need them
+    os.environ.setdefault('CODE4ME_BACKEND', 'mock')
+    for module in args.modules:
+        print(f'{module:16} {import_time(module, args.repeats) * 1000:8.1f} ms   slowest:',
+              ', '.join(f'{name} {micros / 1000:.1f} ms' for micros, name in slowest_imports(module)[1:4]))
@@ -0,0 +1,74 @@
+import ast
+import io
+import tokenize
+
+
+def _docstrings(tree):
+    # the docstring statements of the module, classes and functions
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) \
+                    and isinstance(first.value.value, str):
+                yield node, first
+
+
+def compact_code(code, shorten_literals=False, max_literal=80):
+    """
+    Compact code before it goes into a prompt: docstrings, comments and blank lines are removed,
+    and optionally string literals longer than max_literal characters are cut.
+    Code that does not parse, or whose compaction would not parse, is returned unchanged.
+    """
+    try:
+        tree = ast.parse(code)
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (SyntaxError, tokenize.TokenError, IndentationError):
+        return code
+    lines = code.splitlines()
+    removed = set()
+    replaced = {}
+    for node, docstring in _docstrings(tree):
+        following = node.body[1].lineno if len(node.body) > 1 else None
+        if following == docstring.end_lineno or lines[docstring.lineno - 1][:docstring.col_offset].strip():
+            continue  # shares its lines with other statements
+        removed.update(range(docstring.lineno, docstring.end_lineno + 1))
+        if following is None and not isinstance(node, ast.Module):
+            replaced[docstring.lineno] = ' ' * docstring.col_offset + '...'
+
+    comments = {}
+    literals = {}
+    string_lines = set()
+    for token in tokens:
+        (start_row, start_col), (end_row, end_col) = token.start, token.end
+        if token.type == tokenize.COMMENT:
+            comments[start_row] = start_col
+        elif token.type == tokenize.STRING:
+            string_lines.update(range(start_row + 1, end_row + 1))
+            if shorten_literals and start_row == end_row and start_row not in removed \
+                    and len(token.string) > max_literal + 2:
+                try:
+                    value = ast.literal_eval(token.string)
+                except (ValueError, SyntaxError):
+                    continue  # f-strings and the like
+                if isinstance(value, str):
+                    literals.setdefault(start_row, []).append((start_col, end_col, repr(value[:max_literal] + '...')))
+
+    compacted = []
+    for row, line in enumerate(lines, start=1):
+        if row in replaced:
+            compacted.append(replaced[row])
+            continue
+        if row in removed:
+            continue
+        if row in comments:
+            line = line[:comments[row]].rstrip()
+        for start_col, end_col, text in sorted(literals.get(row, []), reverse=True):
+            line = line[:start_col] + text + line[end_col:]
+        if line.strip() or row in string_lines:
+            compacted.append(line)
+    result = '\n'.join(compacted) + '\n'
+    try:
+        ast.parse(result)
+    except SyntaxError:
+        return code
+    return result
@@ -0,0 +1,60 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import design_graph
+import utils
+
+# the aspects the critics of an ensemble focus on, in turn
+FOCUSES = [
+    'completeness: whether every feature of the goal is covered by some class or function',
+    'the data model: the classes, their attributes and their types, and how data flows between them',
+    'performance: the data structures and algorithms, for the expected scale of the program',
+    'the API surface: the signatures of the public methods and functions, and how they call each other',
+]
+
+
+def _merge_item(into, item):
+    for key, value in item.items():
+        if key not in into:
+            into[key] = value
+        elif key in design_graph.MEMBER_KEYS and isinstance(into[key], list) and isinstance(value, list):
+            names = {design_graph.task_name(m) if isinstance(m, dict) else m for m in into[key]}
+            into[key] += [m for m in value if (design_graph.task_name(m) if isinstance(m, dict) else m) not in names]
+
+
+def merge_suggestions(critiques):
+    """
+    The suggestions of several critiques as one list, those naming the same symbol merged into one,
+    with the union of their attributes and methods. A critique that is not a list is kept as a text item.
+    """
+    merged = {}
+    for critique in critiques:
+        try:
+            items = utils.parse_answer(critique)
+        except ValueError:
+            items = [critique.strip()]
+        for item in items if isinstance(items, list) else [items]:
+            name = design_graph.task_name(item) if isinstance(item, dict) else None
+            key = name.lower() if name else json.dumps(item, sort_keys=True)
+            if key in merged and isinstance(item, dict):
+                _merge_item(merged[key], item)
+            else:
+                merged.setdefault(key, dict(item) if isinstance(item, dict) else item)
+    return list(merged.values())
+
+
+def critique(initial_prompt, design, model, critics=4, sampling=None):
+    """
+    Critique the design with several critics at once, each focused on an aspect of the design.
+    The design is approved when a majority of the critics approve it; otherwise the suggestions of the others
+    are merged. Returns whether it is approved, and the merged critique as text.
+    """
+    focuses = [FOCUSES[i % len(FOCUSES)] for i in range(critics)]
+    with ThreadPoolExecutor(max_workers=critics) as executor:
+        critiques = list(executor.map(
+            utils.in_context(lambda focus: utils.critic_design(initial_prompt, design, model, sampling, focus)),
+            focuses))
+    objections = [c for c in critiques if not utils.design_approved(c)]
+    if len(objections) < critics / 2:
+        return True, ''
+    return False, json.dumps(merge_suggestions(objections), indent=4)
@@ -0,0 +1,202 @@
+import argparse
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import traceback
+from collections import OrderedDict
+
+import design_library
+import generate_code
+import metrics
+import run_log
+import snippet_cache
+import utils
+
+log = run_log.get_logger('daemon')
+
+SOCKET_PATH = os.path.join(utils.CACHE_DIR, 'daemon.sock')
+# the finished jobs whose final status is kept for the status command
+FINISHED_JOBS = 1000
+# the arguments of generate_code.main a job can set
+JOB_OPTIONS = {'design_iterations', 'folder_name', 'improve_iterations', 'similarity_threshold', 'smoke_test',
+               'performance_iterations', 'warm_start_threshold', 'compact_context', 'speculate', 'sampling',
+               'deterministic', 'critics'}
+
+
+class Job:
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.request = request
+        self.status = 'queued'
+        self.events = queue.Queue()
+        # no more events are kept once the client has left
+        self.listening = True
+
+    def emit(self, event):
+        if self.listening:
+            self.events.put(dict(event, job=self.id))
+
+
+class Daemon:
+    """
+    Long running generator: jobs are queued and run one after the other (or by several workers) in the same
+    process, so that the imports, the connections of the client, the semantic cache, the snippet cache and the
+    design library stay loaded and keep growing from job to job. Each job streams its progress events.
+    Finished jobs are dropped, only the final status of the last FINISHED_JOBS of them is kept.
+    """
+
+    def __init__(self, workers=1):
+        self.jobs = {}
+        self.finished = OrderedDict()
+        self.pending = queue.Queue()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.library = design_library.DesignLibrary(os.path.join(utils.CACHE_DIR, 'design_library.json'))
+        self.snippets = snippet_cache.SnippetCache(os.path.join(utils.CACHE_DIR, 'snippet_cache.json'))
+        metrics.gauge_callback('code4me_queue_depth', self.pending.qsize, queue='daemon')
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, request):
+        with self.lock:
+            job = Job(next(self.ids), request)
+            self.jobs[job.id] = job
+        job.emit({'event': 'queued', 'position': self.pending.qsize()})
+        self.pending.put(job)
+        return job
+
+    def run(self, job):
+        request = job.request
+        options = {name: value for name, value in request.items() if name in JOB_OPTIONS}
+        return generate_code.main(request.get('model', 'gpt-4o'), request['prompt'],
+                                  options.pop('design_iterations', 5), request['project_name'],
+                                  on_event=job.emit, library=self.library, snippets=self.snippets, **options)
+
+    def work(self):
+        while True:
+            job = self.pending.get()
+            job.status = 'running'
+            job.emit({'event': 'started'})
+            try:
+                path = self.run(job)
+            except Exception:
+                job.status = 'failed'
+                job.emit({'event': 'failed', 'error': traceback.format_exc()})
+            else:
+                job.status = 'done'
+                job.emit({'event': 'done', 'path': path})
+            with self.lock:
+                del self.jobs[job.id]
+                self.finished[job.id] = job.status
+                while len(self.finished) > FINISHED_JOBS:
+                    self.finished.popitem(last=False)
+
+    def status(self):
+        with self.lock:
+            jobs = dict(self.finished)
+            jobs.update((job.id, job.status) for job in self.jobs.values())
+        return {'jobs': jobs, 'queued': self.pending.qsize(),
+                'calls': dict(utils.call_stats), 'semantic_cache': utils.semantic_cache().summary(),
+                'snippet_cache': self.snippets.summary(), 'designs': len(self.library.entries)}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    One request per connection, a JSON line: {"command": "submit", "job": {...}}, answered by the stream
+    of the events of the job until it is done or failed, or {"command": "status"}.
+    """
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode())
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            self.send({'event': 'error', 'error': 'the request must be a JSON line'})
+            return
+        daemon = self.server.daemon
+        if request.get('command') == 'status':
+            self.send(daemon.status())
+            return
+        job = request.get('job', {})
+        if request.get('command') != 'submit' or 'prompt' not in job or 'project_name' not in job:
+            self.send({'event': 'error', 'error': 'expected a submit command with a job with a prompt and a project_name'})
+            return
+        job = daemon.submit(job)
+        while True:
+            event = job.events.get()
+            try:
+                self.send(event)
+            except OSError:
+                job.listening = False
+                return  # the client left, the job goes on
+            if event['event'] in ('done', 'failed'):
+                return
+
+
+def serve(path=SOCKET_PATH, workers=1):
+    utils.make_directory(os.path.dirname(path) or '.')
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    server.daemon = Daemon(workers)
+    metrics.start_from_environment()
+    log.info('daemon listening on %s', path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def request(message, path=SOCKET_PATH):
+    """
+    Send a request to the daemon and yield its answers as they come.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall((json.dumps(message) + '\n').encode())
+        with client.makefile() as answers:
+            for line in answers:
+                yield json.loads(line)
+
+
+def submit(job, path=SOCKET_PATH):
+    """
+    Submit a job, a dict of the prompt, the project_name and optionally the model and options of
+    generate_code.main, and yield its progress events. A relative project_name is relative to the working directory
+    of the client, not of the daemon.
+    """
+    job = dict(job, project_name=os.path.abspath(job['project_name'])) if 'project_name' in job else job
+    return request({'command': 'submit', 'job': job}, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generation daemon listening on a local Unix socket.")
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--workers', type=int, default=1)
+    submit_parser = commands.add_parser('submit')
+    submit_parser.add_argument('prompt')
+    submit_parser.add_argument('project_name')
+    submit_parser.add_argument('--model', default='gpt-4o')
+    submit_parser.add_argument('--design-iterations', type=int, default=5)
+    commands.add_parser('status')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.socket, args.workers)
+    elif args.command == 'submit':
+        for event in submit({'prompt': args.prompt, 'project_name': args.project_name, 'model': args.model,
+                             'design_iterations': args.design_iterations}, args.socket):
+            print(json.dumps(event))
+    else:
+        for answer in request({'command': 'status'}, args.socket):
+            print(json.dumps(answer, indent=4))
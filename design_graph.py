@@ -0,0 +1,154 @@
+import re
+
+# keys of a task of the design whose values name what the task defines, in both spellings the designs use
+NAME_KEYS = ('class', 'class_name', 'function', 'function_name', 'name', 'method', 'method_name')
+# keys naming a class
+CLASS_KEYS = ('class', 'class_name')
+# the main function of the program, asked for by the design prompts, which uses the rest of the design
+ENTRY_POINT = 'run'
+# keys of the lists of members of a class task
+MEMBER_KEYS = ('methods', 'attributes')
+
+
+def task_name(task):
+    for key in NAME_KEYS:
+        if isinstance(task.get(key), str):
+            return task[key]
+    return None
+
+
+def is_class(task):
+    return any(key in task for key in CLASS_KEYS)
+
+
+def defined_names(task):
+    """
+    The names a task of the design defines: its own name, and the names of its methods and attributes.
+    """
+    names = {task_name(task)} - {None}
+    for key in MEMBER_KEYS:
+        for member in task.get(key, []) or []:
+            if isinstance(member, dict) and task_name(member):
+                names.add(task_name(member))
+            elif isinstance(member, str) and member.isidentifier():
+                names.add(member)
+    return names - {'__init__', 'self'}
+
+
+def _text(task):
+    # the values of a task, not its keys, such as 'class_name' or 'return_type'
+    if isinstance(task, dict):
+        return '\n'.join(_text(value) for value in task.values())
+    if isinstance(task, (list, tuple)):
+        return '\n'.join(_text(value) for value in task)
+    return str(task)
+
+
+def mentioned_names(task):
+    return set(re.findall(r"\w+", _text(task)))
+
+
+def called_names(task):
+    """
+    The names a task refers to as code: called, as attributes, or written as identifiers with an underscore,
+    which a description does not use as plain words.
+    """
+    names = {name for pair in re.findall(r"\.(\w+)|(\w+)\s*\(", _text(task)) for name in pair if name}
+    return names | {word for word in mentioned_names(task) if '_' in word.strip('_')}
+
+
+def depends_on(task, other):
+    """
+    Whether a task of the design refers to what another one defines: the name of the other task, as a word
+    in any case (the types of its attributes and parameters, its description), or one of its members as code.
+    The main function depends on every other task.
+    """
+    if task_name(task) == ENTRY_POINT and task_name(other) != ENTRY_POINT:
+        return True
+    own = defined_names(task)
+    words = {word.lower() for word in mentioned_names(task) - own}
+    name = task_name(other)
+    return bool(name and name not in own and name.lower() in words) or \
+        bool((called_names(task) - own) & defined_names(other))
+
+
+def dependency_graph(tasks):
+    """
+    For each task of the design, by index, the set of the indices of the tasks it depends on.
+    """
+    return {i: {j for j, other in enumerate(tasks) if j != i and depends_on(task, other)}
+            for i, task in enumerate(tasks)}
+
+
+def components(graph):
+    """
+    The strongly connected components of the graph, the groups of tasks that depend on each other,
+    directly or not, as sorted lists of indices (Tarjan's algorithm).
+    """
+    order, low, stack, on_stack, result = {}, {}, [], set(), []
+
+    def visit(node):
+        order[node] = low[node] = len(order)
+        stack.append(node)
+        on_stack.add(node)
+        for dependency in graph[node]:
+            if dependency not in order:
+                visit(dependency)
+                low[node] = min(low[node], low[dependency])
+            elif dependency in on_stack:
+                low[node] = min(low[node], order[dependency])
+        if low[node] == order[node]:
+            component = []
+            while not component or component[-1] != node:
+                component.append(stack.pop())
+                on_stack.discard(component[-1])
+            result.append(sorted(component))
+
+    for node in graph:
+        if node not in order:
+            visit(node)
+    return result
+
+
+def cycles(graph):
+    """
+    The groups of tasks with circular dependencies.
+    """
+    return [component for component in components(graph) if len(component) > 1]
+
+
+def layers(tasks, graph=None):
+    """
+    The tasks of the design in layers, lists of indices: a task depends only on tasks of earlier layers,
+    so the tasks of a layer can be coded in parallel once the earlier layers are. Classes come first in a layer,
+    then the tasks in the order of the design.
+    A cycle is broken by putting one of its tasks, a class if any, in a layer before the other tasks of the cycle
+    it depends on, once its other dependencies are done: the code of a function or method refers to names that
+    only need to exist when it runs.
+    """
+    graph = dependency_graph(tasks) if graph is None else graph
+
+    def key(node):
+        return not is_class(tasks[node]), node
+
+    circular = [set(cycle) for cycle in cycles(graph)]
+    done, result = set(), []
+    while len(done) < len(graph):
+        pending = {node: graph[node] - done for node in graph if node not in done}
+        layer = [node for node, dependencies in pending.items() if not dependencies]
+        for cycle in circular:
+            members = [node for node in cycle if node in pending]
+            if members and all(pending[node] and pending[node] <= cycle for node in members):
+                layer.append(min(members, key=key))
+        layer.sort(key=key)
+        result.append(layer)
+        done.update(layer)
+    return result
+
+
+def topological_order(tasks, graph=None):
+    """
+    The indices of the tasks of the design in an order where each task comes after the tasks it depends on,
+    but for cycles.
+    """
+    return [node for layer in layers(tasks, graph) for node in layer]
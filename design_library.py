@@ -0,0 +1,81 @@
+import glob
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import json_store
+
+# words too common in prompts to tell applications apart
+STOPWORDS = set("""
+a an and are as at be by can code create each for from has have in include is it its of on or should such that the
+their them they this to use user users using which will with would python program application app feature features
+""".split())
+
+
+def keywords(text):
+    return Counter(word for word in re.findall(r"[a-z][a-z0-9_]+", text.lower()) if word not in STOPWORDS)
+
+
+class DesignLibrary:
+    """
+    Finalized designs indexed by the keyword vector of their prompt, to start a new design
+    from the closest prior one rather than from scratch. Similarity is the cosine of TF-IDF vectors.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.entries = []
+        if os.path.exists(path):
+            with open(path) as file:
+                self.entries = json.load(file)
+
+    def save(self):
+        with self.lock:
+            json_store.write_json_atomic(self.path, self.entries)
+
+    def add(self, prompt, design, source=None):
+        """
+        Index a design by its prompt, or by its own text when the prompt is unknown.
+        """
+        with self.lock:
+            if any(entry['design'] == design for entry in self.entries):
+                return
+            self.entries.append({'prompt': prompt, 'design': design, 'source': source,
+                                 'keywords': keywords(prompt or design)})
+            self.save()
+
+    def index_existing(self, root='.'):
+        """
+        Index the generated_design.txt files saved by previous runs under root.
+        """
+        for path in glob.glob(os.path.join(root, '**', 'generated_design.txt'), recursive=True):
+            with open(path) as file:
+                design = file.read().strip()
+            if design:
+                self.add(None, design, source=path)
+
+    def _idf(self):
+        counts = Counter(word for entry in self.entries for word in entry['keywords'])
+        return {word: math.log((1 + len(self.entries)) / (1 + count)) + 1 for word, count in counts.items()}
+
+    def closest(self, prompt):
+        """
+        Return the similarity and the entry of the design closest to the prompt, or (0, None) if the library is empty.
+        """
+        idf = self._idf()
+        query = {word: count * idf.get(word, 1.0) for word, count in keywords(prompt).items()}
+        query_norm = math.sqrt(sum(v * v for v in query.values()))
+        best, best_similarity = None, 0.0
+        for entry in self.entries:
+            vector = {word: count * idf[word] for word, count in entry['keywords'].items()}
+            norm = math.sqrt(sum(v * v for v in vector.values()))
+            if not norm or not query_norm:
+                continue
+            similarity = sum(v * vector.get(word, 0.0) for word, v in query.items()) / (norm * query_norm)
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+        return best_similarity, best
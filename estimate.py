@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+import utils
+
+# what is estimated for a run
+TARGETS = ['calls', 'prompt_tokens', 'completion_tokens', 'seconds']
+# the settings of a run the estimates depend on, besides the size of the design
+SETTINGS = ['design_iterations', 'improve_iterations', 'performance_iterations']
+# wait of the throttles of the pipeline, in seconds, per design iteration and per coding or improvement call
+DESIGN_WAIT, CODING_WAIT = 10, 20
+
+
+def load_traces(path=None, backend=None):
+    """
+    The call and run records of the traces of the backend, the current one by default.
+    """
+    path = path or utils.TRACE_PATH
+    backend = backend or utils.BACKEND
+    calls, runs = [], []
+    if not os.path.exists(path):
+        return calls, runs
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut by an interrupted run
+            if record.get('backend') != backend:
+                continue
+            if record.get('type') == 'call':
+                calls.append(record)
+            elif record.get('type') == 'run':
+                runs.append(record)
+    return calls, runs
+
+
+def prompt_words(prompt):
+    return len(re.findall(r"\w+", prompt))
+
+
+def expected_tasks(prompt, runs):
+    """
+    The expected number of tasks of the design of the prompt: proportional to its length, fitted on the
+    previous runs, else one task per 40 words of the prompt, and at least 3.
+    """
+    words = prompt_words(prompt)
+    sized = [run for run in runs if run.get('tasks') and run.get('prompt_words')]
+    if len(sized) >= 3:
+        per_word = sum(run['tasks'] for run in sized) / sum(run['prompt_words'] for run in sized)
+        return max(1.0, words * per_word)
+    return max(3.0, words / 40)
+
+
+def features(words, tasks, settings):
+    return [1.0, words, tasks] + [settings[name] for name in SETTINGS]
+
+
+def heuristic(tasks, settings, calls):
+    """
+    Estimate from the structure of the pipeline: one design call, two per design iteration, one or two
+    per task, two per improvement iteration and performance iteration, at the average size and latency
+    of the traced calls, or of typical calls without traces.
+    """
+    count = (1 + 2 * settings['design_iterations'] + 1.2 * tasks + 1
+             + 2 * settings['improve_iterations'] + 2 * settings['performance_iterations'])
+    prompt_tokens = np.mean([c['prompt_tokens'] for c in calls]) if calls else 1500
+    completion_tokens = np.mean([c['completion_tokens'] for c in calls]) if calls else 500
+    latency = np.mean([c['latency'] for c in calls]) if calls else 15.0
+    waits = 0 if utils.BACKEND == 'mock' else (
+        DESIGN_WAIT * settings['design_iterations']
+        + CODING_WAIT * (tasks + settings['improve_iterations'] + settings['performance_iterations']))
+    return {'calls': count, 'prompt_tokens': count * prompt_tokens, 'completion_tokens': count * completion_tokens,
+            'seconds': count * latency + waits}
+
+
+def estimate(prompt, design_iterations=5, improve_iterations=5, performance_iterations=1, trace_path=None):
+    """
+    Estimate the calls, prompt and completion tokens and duration of a run of generate_code.main.
+    With enough traced runs, by a least squares regression of each quantity on the length of the prompt,
+    the expected number of tasks and the iteration counts; else by the heuristic. The regression needs the
+    runs to vary in every feature: runs with the same settings leave their coefficients undetermined.
+    """
+    calls, runs = load_traces(trace_path)
+    settings = {'design_iterations': design_iterations, 'improve_iterations': improve_iterations,
+                'performance_iterations': performance_iterations}
+    tasks = expected_tasks(prompt, runs)
+    runs = [run for run in runs if all(name in run for name in TARGETS + SETTINGS + ['prompt_words', 'tasks'])]
+    x = features(prompt_words(prompt), tasks, settings)
+    matrix = np.array([features(run['prompt_words'], run['tasks'], run) for run in runs]).reshape(-1, len(x))
+    if len(runs) > len(x) and np.linalg.matrix_rank(matrix) == len(x):
+        targets = np.array([[run[name] for name in TARGETS] for run in runs], dtype=float)
+        coefficients, *_ = np.linalg.lstsq(matrix, targets, rcond=None)
+        values = dict(zip(TARGETS, np.maximum(np.array(x) @ coefficients, 0.0)))
+        method = f'regression over {len(runs)} runs'
+    else:
+        values = heuristic(tasks, settings, calls)
+        method = f'heuristic, {len(runs)} runs traced'
+    result = {name: int(round(value)) for name, value in values.items()}
+    result['minutes'] = round(float(values['seconds']) / 60, 1)
+    result['expected_tasks'] = round(float(tasks), 1)
+    result['method'] = method
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the cost and duration of a run without running it.")
+    parser.add_argument('prompt', help="the prompt, or @path of a file holding it")
+    parser.add_argument('--design-iterations', type=int, default=5)
+    parser.add_argument('--improve-iterations', type=int, default=5)
+    parser.add_argument('--performance-iterations', type=int, default=1)
+    parser.add_argument('--traces', default=None, help="the JSONL traces, by default those of the cache directory")
+    args = parser.parse_args()
+    prompt = args.prompt
+    if prompt.startswith('@'):
+        with open(prompt[1:]) as file:
+            prompt = file.read()
+    print(json.dumps(estimate(prompt, args.design_iterations, args.improve_iterations, args.performance_iterations,
+                              args.traces), indent=4))
@@ -1,9 +1,127 @@
 import utils
+import static_checker
+import repair
+import profiling
+import design_library
+import snippet_cache
+import symbol_index
+import compaction
+import critic_ensemble
+import design_graph
+import governor
+import metrics
+import prompts
+import run_log
+import estimate
 import os
-from time import sleep
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+log = run_log.get_logger('generate_code')
 
-def main(model, initial_prompt, design_iterations, project_name, folder_name='generated_scripts'):
+# the tasks of a layer of the design coded at the same time
+CODING_WORKERS = 4
+
+
+def code_task(task, current_code, design_names, model, snippets, index, compact_context=True, sampling=None):
+    """
+    Implement a task of the design after the current code: with the cached implementation of the same task
+    if it still passes the static check here, else with a coding call, checked and repaired.
+    The current code given to the model is compacted, and cut down to the symbols of the index
+    most relevant to the task once it is long.
+    Returns the code and whether an LLM call was made.
+    """
+    code = snippets.get(task)
+    if code is not None:
+        code, failures = static_checker.gate(code, context=current_code, known_names=design_names)
+        if not failures:
+            log.info('Reusing the cached implementation')
+            return code, False
+    context = compaction.compact_code(current_code) if compact_context else current_code
+    context = symbol_index.relevant_code(context, index, str(task))
+    if ('description' in task.keys() and 'class' in task['description']) or 'class' in task:
+        code = utils.class_coder(context, str(task), model, sampling)
+    else:
+        code = utils.function_coder(context, str(task), model, sampling)
+    code = utils.parse_code_output(code)
+    # fix what can be fixed locally, and only ask for a repair of this fragment if real errors remain
+    code, failures = static_checker.gate(code, context=current_code, known_names=design_names)
+    if failures:
+        log.warning('Static check failures: %s', static_checker.format_diagnostics(failures))
+        code = utils.repair_code(code, static_checker.format_diagnostics(failures), model, sampling=sampling)
+        code, failures = static_checker.gate(utils.parse_code_output(code), context=current_code,
+                                             known_names=design_names)
+    if not failures:
+        snippets.put(task, code)
+    return code, True
+
+
+def accept_speculation(code, current_code, previous_code, design_names):
+    """
+    Re-validate the code of a task written speculatively, alongside the tasks before it in its layer:
+    it is kept if it passes the static check against the current code and does not define again
+    what the code of these tasks, previous_code, defined. Returns the checked code, or None if it must be redone.
+    """
+    code, failures = static_checker.gate(code, context=current_code, known_names=design_names)
+    if failures:
+        return None
+    try:
+        redefined = set(symbol_index.top_level_symbols(code)) & set(symbol_index.top_level_symbols(previous_code))
+    except SyntaxError:
+        return None
+    return None if redefined else code
+
+
+def repair_program(code, failures, filepath, model, smoke_test=True, index=None, sampling=None):
+    """
+    Repair the failing symbols of the program saved at filepath, found by the static checker and, optionally,
+    by executing the module. The repaired program is saved back to filepath and returned.
+    """
+    if smoke_test and not failures:
+        failures = repair.diagnostics_from_traceback(repair.smoke_test(filepath), filepath)
+    if not failures:
+        return code
+    log.info('Failures to repair: %s', static_checker.format_diagnostics(failures))
+    code, repaired = repair.repair(code, failures, model, index=index, sampling=sampling)
+    log.info('Repaired symbols: %s', repaired)
+    code, failures = static_checker.gate(code)
+    if failures:
+        log.warning('Remaining failures: %s', static_checker.format_diagnostics(failures))
+    utils.save_code_to_file(code, filepath, mode='w')
+    return code
+
+
+@utils.own_context
+def main(model, initial_prompt, design_iterations, project_name, folder_name='generated_scripts',
+         improve_iterations=5, similarity_threshold=0.95, smoke_test=True, performance_iterations=1,
+         warm_start_threshold=0.3, compact_context=True, speculate=True, budget=None,
+         dry_run=False, on_event=None, library=None, snippets=None, sampling=None, deterministic=False,
+         critics=1, cache_variant=None):
+    """
+    Generate a program for the prompt: design, code each task of the design, improve the code until it converges,
+    then improve its performance. The iteration counts are maxima; with a governor.Budget, the design and improvement
+    phases also stop once their share of the budget is spent, the coding goes on with a cheaper model past its share,
+    the calls switch to a cheaper model when the budget runs low,
+    and the run ends with the last version of the code when it is exhausted.
+    The sampling gives the temperature, seed, top_p and max_tokens of the calls, per stage name or for all
+    as "default"; the deterministic mode pins them so that the same prompts give the same answers.
+    With several critics, each design round is critiqued by an ensemble of critics in parallel.
+    The cache variant tells apart runs whose prompts are alike but ask for different programs, such as the modules
+    of a hierarchical run, so that they never reuse each other's cached designs.
+    Progress events, dicts with an 'event' key, are passed to on_event as the run goes.
+    A long running process can pass its own design library and snippet cache to keep them loaded between runs.
+    Returns the path of the generated program, or with dry_run, only the estimate of the cost of the run.
+    """
+    if dry_run:
+        return estimate.estimate(initial_prompt, design_iterations, improve_iterations, performance_iterations)
+    start_time, calls = time.monotonic(), utils.CallCounter()
+    if deterministic:
+        sampling = utils.deterministic_sampling(sampling)
+    notify = on_event or (lambda event: None)
+    if budget is None:
+        budget = governor.Budget()
+    utils.count_calls(calls, budget.calls)
 
     utils.make_directory(project_name)
     folder_name = os.path.join(project_name, folder_name)
@@ -11,45 +129,169 @@ def main(model, initial_prompt, design_iterations, project_name, folder_name='ge
 
     utils.erase_current_code(folder_name)
     utils.erase_current_design(folder_name)
+    utils.erase_iterations(folder_name)
 
-    design = utils.designer(initial_prompt, model)
-    print('first design:', type(design), design)
+    # start from the design of the most similar previous prompt, if close enough
+    if library is None:
+        library = design_library.DesignLibrary(os.path.join(utils.CACHE_DIR, 'design_library.json'))
+    if not library.entries:
+        library.index_existing()
+    similarity, prior = library.closest(initial_prompt)
+    if prior is not None and similarity >= warm_start_threshold:
+        log.info('starting from a similar design (similarity %.2f): %s', similarity, prior['prompt'] or prior['source'])
+        design = utils.designer(initial_prompt, model, starting_design=prior['design'], sampling=sampling)
+    else:
+        design = utils.designer(initial_prompt, model, sampling=sampling, variant=cache_variant)
+    log.info('first design: %s', design, extra={'fields': {'stage': 'design'}})
     for _ in range(design_iterations):
-        critic = utils.critic_design(initial_prompt, design, model)
-        print('critic:', critic)
-        design = utils.concatenate_designs(design, critic, model)
-        sleep(10)
-    print('final design:', design)
-    print('---------------')
+        if not budget.allows('design'):
+            break
+        if critics > 1:
+            approved, critic = critic_ensemble.critique(initial_prompt, design, budget.model(model), critics, sampling)
+        else:
+            critic = utils.critic_design(initial_prompt, design, budget.model(model), sampling)
+            approved = utils.design_approved(critic)
+        log.info('critic: %s', critic, extra={'fields': {'stage': 'critic_design'}})
+        if approved:
+            break
+        design = utils.concatenate_designs(design, critic, budget.model(model), sampling)
+        utils.throttle(10)
+    log.info('final design: %s', design, extra={'fields': {'stage': 'design', 'final': True}})
     utils.save_design_to_file(design, folder_name)
+    notify({'event': 'design', 'design': design})
+    library.add(initial_prompt, design)
 
     # now code each subproblem in the design
     list_of_tasks = utils.parse_answer(design)
-    for i, task in enumerate(list_of_tasks):
-        print('Subproblem', i, task)
-        if ('description' in task.keys() and 'class' in task['description']) or 'class' in task:
-            current_code = utils.get_current_code(folder_name)
-            code = utils.class_coder(current_code, str(task), model)
-        else:
-            current_code = utils.get_current_code(folder_name)
-            code = utils.function_coder(current_code, str(task), model)
-        code = utils.parse_code_output(code)
-        print('Generated code:', code)
-        filepath = f'{folder_name}/generated_code_iteration0.py'
-        utils.save_code_to_file(code, filepath)
-        sleep(20)
-        print('---------------')
-
-    for i in range(1, 6):
-        print('iteration i:', i)
-        version = i - 1
-        answer = utils.improve_code(initial_prompt, utils.get_current_code(folder_name, version=version), model)
-        answer = utils.parse_code_output(answer)
+    # names of the design that later tasks will define are not undefined yet
+    design_names = set(re.findall(r"\w+", design))
+    filepath = f'{folder_name}/generated_code_iteration0.py'
+    if snippets is None:
+        snippets = snippet_cache.SnippetCache(os.path.join(utils.CACHE_DIR, 'snippet_cache.json'))
+    metrics.gauge_callback('code4me_cache_hit_rate', snippets.hit_rate, cache='snippet')
+    index = symbol_index.SymbolIndex()
+    # the tasks are coded in the order of their dependencies, layer by layer; with speculate, the tasks of a layer,
+    # which the design predicts do not need each other, are coded at the same time, each with its own index,
+    # the index is not shared between threads
+    graph = design_graph.dependency_graph(list_of_tasks)
+    for cycle in design_graph.cycles(graph):
+        log.warning('circular dependencies between the tasks %s', cycle)
+    layers = design_graph.layers(list_of_tasks, graph)
+    log.info('coding order, by layer: %s', layers)
+    coded, speculations = 0, {'issued': 0, 'kept': 0, 'discarded': 0}
+    # the speculative tasks count their calls for this run
+    code_in_run = utils.in_context(code_task)
+    with ThreadPoolExecutor(max_workers=CODING_WORKERS) as executor:
+        for layer in layers:
+            if budget.exhausted():
+                break
+            current_code = utils.get_current_code(folder_name, version=0)
+            speculation = {i: executor.submit(code_in_run, list_of_tasks[i], current_code, design_names,
+                                              budget.phase_model('coding', model), snippets, symbol_index.SymbolIndex(),
+                                              compact_context, sampling)
+                           for i in layer[1:]} if speculate else {}
+            speculations['issued'] += len(speculation)
+            layer_code, layer_called = '', False
+            for i in layer:
+                if budget.exhausted():
+                    break
+                task = list_of_tasks[i]
+                log.info('Subproblem %d %s', i, task, extra={'fields': {'task_index': i}})
+                notify({'event': 'task', 'index': coded, 'tasks': len(list_of_tasks)})
+                current_code = utils.get_current_code(folder_name, version=0)
+                code = None
+                if i in speculation:
+                    code, called = speculation[i].result()
+                    code = accept_speculation(code, current_code, layer_code, design_names)
+                    speculations['kept' if code is not None else 'discarded'] += 1
+                    log.info('Speculative implementation %s', 'kept' if code is not None else 'discarded')
+                if code is None:
+                    code, called = code_task(task, current_code, design_names, budget.phase_model('coding', model),
+                                             snippets, index, compact_context, sampling)
+                log.info('Generated code: %s', code, extra={'fields': {'task_index': i}})
+                utils.save_code_to_file(code, filepath)
+                layer_code += f'\n\n{code}'
+                layer_called = layer_called or called
+                coded += 1
+            if layer_called:
+                utils.throttle(20)
+    if coded < len(list_of_tasks):
+        log.warning('budget exhausted, %d tasks left uncoded', len(list_of_tasks) - coded)
+    if speculations['issued']:
+        log.info('speculative coding: %s', speculations)
+
+    # the fragments are checked one by one, the whole program may still have duplicate classes or imports
+    code, failures = static_checker.gate(utils.get_current_code(folder_name, version=0))
+    utils.save_code_to_file(code, filepath, mode='w')
+    if not budget.exhausted():
+        repair_program(code, failures, filepath, budget.model(model), smoke_test, index, sampling)
+
+    # improve the whole code until it stops changing meaningfully
+    final_version = 0
+    for i in range(1, improve_iterations + 1):
+        if not budget.allows('improvement'):
+            break
+        log.info('improvement iteration %d', i)
+        notify({'event': 'improvement', 'iteration': i})
+        previous_code = utils.get_current_code(folder_name, version=i - 1)
+        # the answer is the next version of the program, it gets the full code to keep its docstrings and comments
+        answer = utils.improve_code(initial_prompt, previous_code, budget.model(model), sampling)
+        answer, failures = static_checker.gate(utils.parse_code_output(answer))
         filepath = f'{folder_name}/generated_code_iteration{i}.py'
         utils.save_code_to_file(answer, filepath)
-        sleep(20)
+        answer = repair_program(answer, failures, filepath, budget.model(model), smoke_test, index, sampling)
+        final_version = i
+        similarity = utils.code_similarity(previous_code, answer)
+        log.info('similarity with previous version: %.3f', similarity)
+        if similarity >= similarity_threshold:
+            log.info('code converged at iteration %d, %d improvement iterations saved', i, improve_iterations - i)
+            break
+        utils.throttle(20)
+
+    # make the code faster, driven by the profile of the same synthetic workload at each iteration
+    workload = None
+    for _ in range(performance_iterations):
+        if not budget.allows('improvement'):
+            break
+        current_code = utils.get_current_code(folder_name, version=final_version)
+        prompt_code = compaction.compact_code(current_code) if compact_context else current_code
+        if workload is None:
+            workload = utils.parse_code_output(utils.workload_writer(initial_prompt, prompt_code, budget.model(model),
+                                                                      sampling))
+            utils.save_code_to_file(workload, f'{folder_name}/profile_workload.py', mode='w')
+        hotspots, total_time = profiling.profile_program(f'{folder_name}/generated_code_iteration{final_version}.py',
+                                                         workload)
+        if not hotspots:
+            log.info('No hotspot found, no performance improvement')
+            break
+        report = profiling.format_hotspots(hotspots, total_time)
+        log.info('Profiled time %.3f s, hotspots: %s', total_time, report)
+        notify({'event': 'performance', 'profiled_time': total_time})
+        # the answer is the next version of the program, it gets the full code to keep its docstrings and comments
+        answer = utils.improve_performance(initial_prompt, current_code, report, budget.model(model), sampling)
+        answer, failures = static_checker.gate(utils.parse_code_output(answer))
+        final_version += 1
+        filepath = f'{folder_name}/generated_code_iteration{final_version}.py'
+        utils.save_code_to_file(answer, filepath)
+        repair_program(answer, failures, filepath, budget.model(model), smoke_test, index, sampling)
+        utils.throttle(20)
+    final_path = f'{folder_name}/generated_code.py'
+    utils.save_code_to_file(utils.get_current_code(folder_name, version=final_version), final_path)
+    log.info('semantic cache: %s', utils.semantic_cache().summary())
+    snippets.save()
+    log.info('snippet cache: %s', snippets.summary())
+    log.info('budget used: %s', budget.summary())
+    log.info('prompt prefix shared with the previous call of the stage: %s', prompts.prefix_report.summary())
+    utils.trace(dict(calls.totals,
+                     type='run', model=model, prompt_words=estimate.prompt_words(initial_prompt),
+                     tasks=len(list_of_tasks), layers=len(layers), design_iterations=design_iterations,
+                     improve_iterations=improve_iterations, performance_iterations=performance_iterations,
+                     sampling=sampling,
+                     seconds=time.monotonic() - start_time))
+    return final_path
 
 if __name__ == "__main__":
+    metrics.start_from_environment()
 
     model = 'gpt-4o'
     # this is just an example prompt, itself refined by online chatGPT
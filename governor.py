@@ -0,0 +1,108 @@
+import threading
+import time
+
+import run_log
+import utils
+
+log = run_log.get_logger('governor')
+
+# dollars per million prompt and completion tokens
+PRICES = {'gpt-4o': (2.5, 10.0), 'gpt-4o-mini': (0.15, 0.6), 'gpt-4-turbo': (10.0, 30.0), 'gpt-4': (30.0, 60.0),
+          'gpt-3.5-turbo': (0.5, 1.5)}
+# the cheaper model used once most of the budget is spent
+DOWNGRADES = {'gpt-4o': 'gpt-4o-mini', 'gpt-4-turbo': 'gpt-4o', 'gpt-4': 'gpt-4o', 'gpt-3.5-turbo': 'gpt-3.5-turbo'}
+# the share of the budget of each phase of a run, in order; what a phase leaves unused goes to the next ones
+SHARES = [('design', 0.15), ('coding', 0.55), ('improvement', 0.30)]
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, PRICES['gpt-4o'])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+class Budget:
+    """
+    Budget of a run, in wall time (seconds), total tokens, calls and estimated cost (dollars), any of them
+    optional. It is shared between the design, coding and improvement phases, each allowed to spend up to
+    its cumulative share: a phase gets another iteration only if the average cost of its iterations so far
+    still fits. Once downgrade_at of the budget is spent, the calls use a cheaper model, and so do the coding calls
+    past the coding share.
+    """
+
+    def __init__(self, seconds=None, tokens=None, calls=None, cost=None, shares=SHARES, downgrade_at=0.7):
+        self.limits = {'seconds': seconds, 'tokens': tokens, 'calls': calls, 'cost': cost}
+        self.shares = shares
+        self.downgrade_at = downgrade_at
+        self.start_time = time.monotonic()
+        # the calls of the run, counted once the run counts them with it (see utils.count_calls)
+        self.calls = utils.CallCounter()
+        self.lock = threading.Lock()
+        self.phase, self.phase_start, self.phase_iterations = None, 0.0, 0
+        self.downgraded = False
+
+    def used(self):
+        """
+        What the run has spent so far.
+        """
+        used = {'seconds': time.monotonic() - self.start_time, 'tokens': 0, 'calls': 0, 'cost': 0.0}
+        for model, stats in self.calls.per_model().items():
+            used['tokens'] += stats['prompt_tokens'] + stats['completion_tokens']
+            used['calls'] += stats['calls']
+            used['cost'] += cost(model, stats['prompt_tokens'], stats['completion_tokens'])
+        return used
+
+    def fraction(self):
+        """
+        The fraction of the budget spent, that of the most spent of the limits.
+        """
+        used = self.used()
+        return max([used[name] / limit for name, limit in self.limits.items() if limit], default=0.0)
+
+    def exhausted(self):
+        return self.fraction() >= 1.0
+
+    def allows(self, phase):
+        """
+        Whether one more iteration of the phase fits in the budget, counted as started if so.
+        """
+        with self.lock:
+            fraction = self.fraction()
+            if phase != self.phase:
+                self.phase, self.phase_start, self.phase_iterations = phase, fraction, 0
+            end = 0.0
+            for name, share in self.shares:
+                end += share
+                if name == phase:
+                    break
+            average = (fraction - self.phase_start) / self.phase_iterations if self.phase_iterations else 0.0
+            if fraction + average > min(end, 1.0) and fraction > 0:
+                log.info('budget: share of the %s spent, %.0f%% of the budget spent', phase, fraction * 100)
+                return False
+            self.phase_iterations += 1
+            return True
+
+    def model(self, model):
+        """
+        The model to call: the given one, or a cheaper one once most of the budget is spent.
+        """
+        if self.fraction() < self.downgrade_at:
+            return model
+        cheaper = DOWNGRADES.get(model, model)
+        if cheaper != model and not self.downgraded:
+            self.downgraded = True
+            log.warning('budget: %.0f%% spent, switching from %s to %s', self.fraction() * 100, model, cheaper)
+        return cheaper
+
+    def phase_model(self, phase, model):
+        """
+        The model for one more iteration of a phase that cannot stop early, such as coding, where a program with
+        tasks left out is not worth improving: past the share of the phase, the cheaper model, so that the phase
+        eats as little as it can of the share of the next ones.
+        """
+        if self.allows(phase):
+            return self.model(model)
+        return DOWNGRADES.get(model, model)
+
+    def summary(self):
+        used = self.used()
+        return {name: (round(used[name], 3), limit) for name, limit in self.limits.items() if limit}
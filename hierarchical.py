@@ -0,0 +1,168 @@
+import ast
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import design_library
+import generate_code
+import repair
+import run_log
+import snippet_cache
+import static_checker
+import utils
+
+log = run_log.get_logger('hierarchical')
+
+
+def interface_stubs(module):
+    """
+    The interface of a module of the design, as text for a prompt.
+    """
+    interface = module.get('interface', [])
+    if isinstance(interface, str):
+        return interface
+    return '\n'.join(item if isinstance(item, str) else json.dumps(item) for item in interface)
+
+
+def module_prompt(initial_prompt, module, modules):
+    """
+    The goal of one module: the overall goal, the interface the module must provide,
+    and the interfaces of the other modules it can import from.
+    """
+    others = '\n\n'.join(f"# module {other['module']}\n{interface_stubs(other)}"
+                         for other in modules if other['module'] != module['module'])
+    return (f"{initial_prompt}\n\n"
+            f"The program is split into modules. Implement only the module `{module['module']}`: "
+            f"{module.get('purpose', '')}\n\n"
+            f"It must provide exactly this interface:\n{interface_stubs(module)}\n\n"
+            f"It can use the other modules through their interfaces only, imported with "
+            f"`from <module> import <name>`, without implementing them:\n{others}")
+
+
+def module_stubs(code):
+    """
+    Stubs of the module level definitions of a generated module, as the other modules see it.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return ''
+    return '\n\n'.join(repair.stub(node) for node in tree.body
+                       if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)))
+
+
+def check_cross_module_imports(sources):
+    """
+    Check that every name imported from a sibling module (from x import y, or import x then x.y)
+    is defined at its module level. Returns the diagnostics of each module.
+    """
+    defined = {}
+    for name, code in sources.items():
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            continue
+        names = set()
+        for node in tree.body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                names.add(node.name)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.Import, ast.ImportFrom)):
+                names |= {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+                names |= {a.asname or a.name.split('.')[0] for a in getattr(node, 'names', [])}
+        defined[name] = names
+
+    diagnostics = {}
+    for name, code in sources.items():
+        found = []
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            diagnostics[name] = [static_checker.diagnostic('syntax', 'error', str(e), e.lineno)]
+            continue
+        aliases = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.level == 0 and node.module in defined:
+                for alias in node.names:
+                    if alias.name != '*' and alias.name not in defined[node.module]:
+                        found.append(static_checker.diagnostic(
+                            'cross-module-import', 'error',
+                            f"module '{node.module}' does not define '{alias.name}'", node.lineno))
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name in defined:
+                        aliases[alias.asname or alias.name] = alias.name
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in aliases \
+                    and node.attr not in defined[aliases[node.value.id]]:
+                found.append(static_checker.diagnostic(
+                    'cross-module-import', 'error',
+                    f"module '{aliases[node.value.id]}' does not define '{node.attr}'", node.lineno))
+        if found:
+            diagnostics[name] = found
+    return diagnostics
+
+
+def integrate(sources, model, max_workers=4, sampling=None):
+    """
+    Fix the cross-module imports of the generated modules, each failing module in its own repair call
+    given the stubs of the other modules. Returns the updated sources and the remaining problems.
+    """
+    problems = check_cross_module_imports(sources)
+    if not problems:
+        return sources, {}
+    log.info('Cross-module problems: %s', {name: static_checker.format_diagnostics(d) for name, d in problems.items()})
+
+    def fix(name):
+        context = '\n\n'.join(f"# module {other}\n{module_stubs(code)}"
+                              for other, code in sources.items() if other != name)
+        answer = utils.repair_code(sources[name], static_checker.format_diagnostics(problems[name]), model,
+                                   context=context, sampling=sampling)
+        return static_checker.fix_code(utils.parse_code_output(answer))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fixed = dict(zip(problems, executor.map(utils.in_context(fix), problems)))
+    sources = dict(sources, **fixed)
+    return sources, check_cross_module_imports(sources)
+
+
+def main(model, initial_prompt, design_iterations, project_name, folder_name='generated_scripts', max_workers=4,
+         **options):
+    """
+    Hierarchical generation, for programs too large for one file: the design is first split into modules with
+    explicit interfaces, each module is then generated and improved on its own, in parallel, against the
+    interfaces of the others, and a final integration step checks and fixes the imports between modules.
+    The options are passed to generate_code.main for each module. Returns the path of the main module.
+    """
+    folder = os.path.join(project_name, folder_name)
+    utils.make_directory(folder)
+    sampling = options.get('sampling')
+    if options.get('deterministic'):
+        sampling = options['sampling'] = utils.deterministic_sampling(sampling)
+    modules = utils.parse_answer(utils.module_designer(initial_prompt, model, sampling))
+    log.info('modules: %s', [module['module'] for module in modules])
+    with open(os.path.join(folder, 'generated_modules.json'), 'w') as file:
+        json.dump(modules, file, indent=4)
+
+    # the modules cannot be executed or profiled before they are put together; they share one design library
+    # and one snippet cache, each run saving its own copies would drop the entries of the others
+    options = dict(options, smoke_test=False, performance_iterations=0)
+    if options.get('library') is None:
+        options['library'] = design_library.DesignLibrary(os.path.join(utils.CACHE_DIR, 'design_library.json'))
+    if options.get('snippets') is None:
+        options['snippets'] = snippet_cache.SnippetCache(os.path.join(utils.CACHE_DIR, 'snippet_cache.json'))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {module['module']: executor.submit(utils.in_context(generate_code.main), model,
+                                                     module_prompt(initial_prompt, module, modules),
+                                                     design_iterations, project_name,
+                                                     os.path.join(folder_name, 'modules', module['module']),
+                                                     cache_variant=module['module'], **options)
+                   for module in modules}
+        sources = {name: utils.get_current_code(os.path.dirname(future.result())) for name, future in futures.items()}
+
+    sources, problems = integrate(sources, model, max_workers, sampling)
+    if problems:
+        log.warning('Remaining cross-module problems: %s',
+                    {name: static_checker.format_diagnostics(d) for name, d in problems.items()})
+    for name, code in sources.items():
+        utils.save_code_to_file(code, os.path.join(folder, f'{name}.py'), mode='w')
+    return os.path.join(folder, 'main.py')
@@ -1,26 +1,182 @@
-from generate_code import main
-import os
-
-def improve_generator_itself():
-    folder_for_model_improvement = 'generated_new_generator'
-    if not os.path.exists(folder_for_model_improvement):
-        os.mkdir(folder_for_model_improvement)
-
-    with open('generate_code.py', 'r') as file:
-        generate_code = file.read()
-    with open('utils.py', 'r') as file:
-        utils_code = file.read()
-
-    # generate improved code
-    initial_prompt = (" I am developping a code that will automatically convert any initial prompt "
-                      "into a fully functional Python program. It works by making iterative calls to chatGPT"
-                      " to both design and code the program. The current version is the following: \n \n"
-                      f"{generate_code} \n\n f{utils_code}\n\n. Now that you understand the current version, and my goal,"
-                      f" please provide feedback on how to improve the program. Dont spend too much efforts on error handlings "
-                      f"or edge cases, as the program is designed to be run in a controlled environment. My main concern is the logic; "
-                      f"how to improve this code generation process. Dont be afraid of being inventive, as I am open to any suggestions."
-                      f"The main goal is somehow to get codes that improve themselves via chatgpt or any other LLM model. \n\n"
-                      f"You can also provide additional tasks, suggest and implement improvements, and so on")
-    main(initial_prompt, folder_for_model_improvement)
-
-improve_generator_itself()
\ No newline at end of file
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import metrics
+import repair
+import run_log
+import static_checker
+import utils
+
+log = run_log.get_logger('improve_generator_itself')
+
+# the modules making up the generator, all copied with each candidate
+GENERATOR_FILES = ['generate_code.py', 'utils.py', 'static_checker.py', 'repair.py', 'profiling.py', 'mock_backend.py',
+                   'prompt_cache.py', 'design_library.py', 'snippet_cache.py', 'symbol_index.py', 'compaction.py',
+                   'hierarchical.py', 'design_graph.py', 'governor.py',
+                   'estimate.py', 'run_log.py',
+                   'metrics.py', 'prompts.py',
+                   'critic_ensemble.py', 'json_store.py']
+# the files a candidate may rewrite
+IMPROVED_FILES = ['generate_code.py', 'utils.py']
+# the lines around each file in the prompt and in the answer; the files themselves contain markdown fences
+FILE_START = "# ---- file: {name} ----"
+FILE_END = "# ---- end of file: {name} ----"
+FILE_BLOCK = re.compile(r"^# ---- file: (\S+) ----\n(.*?)^# ---- end of file: \1 ----[ \t]*$", re.MULTILINE | re.DOTALL)
+# wall time differences below this many seconds are timing noise (the mock benchmark takes well under a second)
+WALL_TIME_NOISE = 1.0
+
+BENCHMARK_PROMPTS = [
+    "Code a command line todo list manager where tasks can be added, completed, listed and saved to a file.",
+    "Code a tic-tac-toe game for two players in the terminal, with detection of wins and draws.",
+    "Code a small library management system to add books, lend them to members and list overdue loans.",
+]
+
+# runs one benchmark prompt with a generator, offline, and prints its call statistics as the last line
+BENCHMARK_DRIVER = """
+import json, sys, time
+import generate_code, utils
+start = time.time()
+generate_code.main('gpt-4o', sys.argv[1], design_iterations=1, project_name=sys.argv[2])
+print(json.dumps(dict(utils.call_stats, wall_time=time.time() - start)))
+"""
+
+
+def benchmark(generator_folder, timeout=600):
+    """
+    Run the generator of a folder on the benchmark prompts with the mock backend, and score it:
+    total wall time, LLM calls and tokens, and the pass rate of the generated programs.
+    """
+    score = {'wall_time': 0.0, 'calls': 0, 'tokens': 0, 'passed': 0, 'failed_runs': 0}
+    # the generator folder comes first, the working directory still provides e.g. openai_apikey
+    env = metrics.subprocess_environment(CODE4ME_BACKEND='mock',
+               PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    with tempfile.TemporaryDirectory() as work_folder:
+        for i, prompt in enumerate(BENCHMARK_PROMPTS):
+            project = os.path.join(work_folder, f'benchmark{i}')
+            try:
+                # the caches start empty for each benchmark, and persist across its prompts only
+                result = subprocess.run([sys.executable, '-c', BENCHMARK_DRIVER, prompt, project],
+                                        cwd=os.path.abspath(generator_folder),
+                                        env=dict(env, CODE4ME_CACHE_DIR=os.path.join(work_folder, 'cache')),
+                                        capture_output=True,
+                                        text=True, timeout=timeout)
+                stats = json.loads(result.stdout.strip().splitlines()[-1])
+            except (subprocess.TimeoutExpired, ValueError, IndexError):
+                score['failed_runs'] += 1
+                continue
+            score['wall_time'] += stats['wall_time']
+            score['calls'] += stats['calls']
+            score['tokens'] += stats['prompt_tokens'] + stats['completion_tokens']
+            program = os.path.join(project, 'generated_scripts', 'generated_code.py')
+            if os.path.exists(program) and passes(program):
+                score['passed'] += 1
+    score['pass_rate'] = score['passed'] / len(BENCHMARK_PROMPTS)
+    return score
+
+
+def passes(program):
+    """
+    A generated program passes if it is free of static check failures and can be executed.
+    """
+    with open(program) as file:
+        code = file.read()
+    return code.strip() != '' and not static_checker.failures(static_checker.check_code(code)) \
+        and repair.smoke_test(program) == ''
+
+
+def beats(candidate, current):
+    """
+    A candidate beats the current generator if its programs pass more often, or as often at a lower cost:
+    no more calls nor tokens, a similar wall time, and strictly better on at least one of them.
+    Wall times within WALL_TIME_NOISE of each other are equal.
+    """
+    if candidate['failed_runs'] > current['failed_runs']:
+        return False
+    if candidate['pass_rate'] != current['pass_rate']:
+        return candidate['pass_rate'] > current['pass_rate']
+    margin = max(0.1 * current['wall_time'], WALL_TIME_NOISE)
+    no_worse = candidate['calls'] <= current['calls'] and candidate['tokens'] <= current['tokens'] \
+        and candidate['wall_time'] <= current['wall_time'] + margin
+    better = candidate['calls'] < current['calls'] or candidate['tokens'] < current['tokens'] \
+        or candidate['wall_time'] < current['wall_time'] - margin
+    return no_worse and better
+
+
+def read_generator(folder):
+    sources = {}
+    for name in IMPROVED_FILES:
+        with open(os.path.join(folder, name)) as file:
+            sources[name] = file.read()
+    return sources
+
+
+def propose_candidate(sources, score, model):
+    """
+    Ask for an improved version of the generator, given its source and its benchmark score.
+    Returns the rewritten files by name.
+    """
+    files = '\n\n'.join(f"{FILE_START.format(name=name)}\n{code.rstrip()}\n{FILE_END.format(name=name)}"
+                        for name, code in sources.items())
+    initial_prompt = (" I am developping a code that will automatically convert any initial prompt "
+                      "into a fully functional Python program. It works by making iterative calls to chatGPT"
+                      " to both design and code the program. The current version is the following: \n \n"
+                      f"{files}\n\n. Now that you understand the current version, and my goal,"
+                      f" please improve the program. Dont spend too much efforts on error handlings "
+                      f"or edge cases, as the program is designed to be run in a controlled environment. My main concern is the logic; "
+                      f"how to improve this code generation process. Dont be afraid of being inventive, as I am open to any suggestions."
+                      f"The main goal is somehow to get codes that improve themselves via chatgpt or any other LLM model. \n\n"
+                      f"On a benchmark of prompts, the current version scores as follows: {json.dumps(score)}. "
+                      f"A better version generates programs that pass more often, using less time, calls and tokens. "
+                      f"Keep the signature of `main` in generate_code.py unchanged.\n\n"
+                      f"Return the full improved version of each file, starting with the line "
+                      f"`{FILE_START.format(name='<name>')}` and ending with the line `{FILE_END.format(name='<name>')}` "
+                      f"as above, with no additional comments.")
+    response = utils.chat_with_gpt(initial_prompt, model, stage="improve_generator")
+    candidate = {}
+    for name, code in FILE_BLOCK.findall(response):
+        if name in IMPROVED_FILES:
+            candidate[name] = code.rstrip() + '\n'
+    return candidate
+
+
+def improve_generator_itself(model='gpt-4o', iterations=3):
+    """
+    Propose improved generators in a loop, benchmark each one offline,
+    and promote a candidate to the best generator only when it beats it.
+    """
+    folder_for_model_improvement = 'generated_new_generator'
+    best_folder = os.path.join(folder_for_model_improvement, 'best')
+    if not os.path.exists(best_folder):
+        os.makedirs(best_folder)
+        for name in GENERATOR_FILES:
+            shutil.copy(name, best_folder)
+
+    best_score = benchmark(best_folder)
+    log.info('current generator: %s', best_score)
+    for i in range(iterations):
+        candidate = propose_candidate(read_generator(best_folder), best_score, model)
+        if not candidate:
+            log.warning('candidate %d could not be parsed', i)
+            continue
+        candidate_folder = os.path.join(folder_for_model_improvement, f'candidate{i}')
+        shutil.copytree(best_folder, candidate_folder, dirs_exist_ok=True)
+        for name, code in candidate.items():
+            utils.save_code_to_file(code, os.path.join(candidate_folder, name), mode='w')
+        score = benchmark(candidate_folder)
+        log.info('candidate %d: %s', i, score)
+        if beats(score, best_score):
+            log.info('candidate %d promoted', i)
+            shutil.copytree(candidate_folder, best_folder, dirs_exist_ok=True)
+            best_score = score
+    with open(os.path.join(folder_for_model_improvement, 'best_score.json'), 'w') as file:
+        json.dump(best_score, file, indent=4)
+    return best_score
+
+
+if __name__ == "__main__":
+    improve_generator_itself()
@@ -0,0 +1,394 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import sqlite3
+import time
+import traceback
+from contextlib import closing, contextmanager
+
+import design_graph
+import generate_code
+import metrics
+import run_log
+import snippet_cache
+import static_checker
+import symbol_index
+import utils
+
+log = run_log.get_logger('job_queue')
+
+QUEUE_PATH = os.path.join(utils.CACHE_DIR, 'jobs.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker TEXT,
+    lease_until REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS dependencies (
+    job INTEGER NOT NULL REFERENCES jobs(id),
+    depends_on INTEGER NOT NULL REFERENCES jobs(id),
+    PRIMARY KEY (job, depends_on)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+"""
+
+
+class JobQueue:
+    """
+    Durable queue of the steps of the pipeline in a SQLite file, shared by any number of worker processes.
+    A job is ready once all the jobs it depends on are done; a worker claims it with a lease, and a job whose
+    lease expires, its worker having crashed, is claimed again, up to its maximum number of attempts.
+    A completed job can add the jobs that follow it, in the same transaction; a job failed for good fails
+    the jobs depending on it.
+    The workers run on the machine of the file: the WAL journal, which lets them read while one writes,
+    relies on shared memory and does not work on a network filesystem.
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        utils.make_directory(os.path.dirname(path) or '.')
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def _add(self, kind, payload, depends_on=(), max_attempts=3):
+        job_id = self.connection.execute(
+            'INSERT INTO jobs (kind, payload, max_attempts, updated) VALUES (?, ?, ?, ?)',
+            (kind, json.dumps(payload), max_attempts, time.time())).lastrowid
+        self.connection.executemany('INSERT OR IGNORE INTO dependencies (job, depends_on) VALUES (?, ?)',
+                                    [(job_id, other) for other in depends_on])
+        return job_id
+
+    def add(self, kind, payload, depends_on=(), max_attempts=3):
+        with self.transaction():
+            return self._add(kind, payload, depends_on, max_attempts)
+
+    def claim(self, worker, lease=600):
+        """
+        Claim the oldest ready job for the worker. Returns the job, a dict of its id, kind, payload and
+        the inputs, the jobs it depends on with their results, or None if no job is ready.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute("UPDATE jobs SET status = 'failed', error = 'lease expired', updated = ? "
+                               "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                               (now, now))
+            self._fail_dependents(connection, now)
+            row = connection.execute(
+                "SELECT * FROM jobs AS j WHERE (status = 'pending' OR (status = 'running' AND lease_until < ?)) "
+                "AND attempts < max_attempts AND NOT EXISTS (SELECT 1 FROM dependencies AS d "
+                "JOIN jobs AS p ON p.id = d.depends_on WHERE d.job = j.id AND p.status != 'done') "
+                "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                               "lease_until = ?, updated = ? WHERE id = ?", (worker, now + lease, now, row['id']))
+            inputs = connection.execute(
+                'SELECT p.id, p.kind, p.payload, p.result FROM dependencies AS d JOIN jobs AS p '
+                'ON p.id = d.depends_on WHERE d.job = ? ORDER BY p.id', (row['id'],)).fetchall()
+        return {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload']),
+                'inputs': [{'id': i['id'], 'kind': i['kind'], 'payload': json.loads(i['payload']),
+                            'result': json.loads(i['result'])} for i in inputs]}
+
+    def complete(self, job, worker, result, follow_ups=()):
+        """
+        Record the result of a job and add its follow-up jobs, dicts of a kind and a payload, each depending
+        on the job and on the follow-ups listed by position in 'after'. Ignored if the job was claimed again
+        by another worker meanwhile.
+        """
+        with self.transaction() as connection:
+            updated = connection.execute(
+                "UPDATE jobs SET status = 'done', result = ?, updated = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result), time.time(), job['id'], worker)).rowcount
+            if not updated:
+                return False
+            ids = []
+            for follow_up in follow_ups:
+                ids.append(self._add(follow_up['kind'], follow_up['payload'],
+                                     [job['id']] + [ids[i] for i in follow_up.get('after', [])]))
+            return True
+
+    def fail(self, job, worker, error):
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                "error = ?, updated = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (error, now, job['id'], worker))
+            self._fail_dependents(connection, now)
+
+    def _fail_dependents(self, connection, now):
+        # the jobs depending on a failed job, directly or not, can never run
+        connection.execute(
+            "WITH RECURSIVE blocked(id) AS (SELECT d.job FROM dependencies AS d JOIN jobs AS p ON p.id = d.depends_on "
+            "WHERE p.status = 'failed' UNION SELECT d.job FROM dependencies AS d JOIN blocked AS b "
+            "ON d.depends_on = b.id) "
+            "UPDATE jobs SET status = 'failed', error = 'a job it depends on failed', updated = ? "
+            "WHERE status = 'pending' AND id IN blocked", (now, ))
+
+    def runnable(self):
+        """
+        The number of jobs that can still run: pending or running, none of the jobs they depend on failed.
+        """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM jobs AS j WHERE status IN ('pending', 'running') AND NOT EXISTS (SELECT 1 "
+            "FROM dependencies AS d JOIN jobs AS p ON p.id = d.depends_on WHERE d.job = j.id "
+            "AND p.status = 'failed')").fetchone()[0]
+
+    def counts(self):
+        return {row['status']: row['count'] for row in self.connection.execute(
+            'SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')}
+
+
+def pending_jobs(path=QUEUE_PATH):
+    """
+    The number of pending jobs, read with a connection of its own: the metrics are rendered by other threads,
+    and a SQLite connection can only be used by the thread that opened it.
+    """
+    with closing(sqlite3.connect(path, timeout=60)) as connection:
+        return connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+
+
+# the caches and the index of the worker process, shared by the jobs it runs
+worker_state = {}
+
+
+def _state():
+    if not worker_state:
+        worker_state['snippets'] = snippet_cache.SnippetCache(os.path.join(utils.CACHE_DIR, 'snippet_cache.json'))
+        worker_state['index'] = symbol_index.SymbolIndex()
+    return worker_state
+
+
+def _version_path(run, version):
+    return f"{run['folder']}/generated_code_iteration{version}.py"
+
+
+def run_design(payload, inputs):
+    run = payload['run']
+    design = utils.designer(run['prompt'], run['model'], sampling=run['sampling'])
+    return {'design': design}, [{'kind': 'critique', 'payload': {'run': run, 'iteration': 1}}]
+
+
+def run_critique(payload, inputs):
+    run, design = payload['run'], inputs[-1]['result']['design']
+    if payload['iteration'] > run['design_iterations']:
+        return {'design': design}, [{'kind': 'plan', 'payload': {'run': run}}]
+    critic = utils.critic_design(run['prompt'], design, run['model'], run['sampling'])
+    if utils.design_approved(critic):
+        return {'design': design}, [{'kind': 'plan', 'payload': {'run': run}}]
+    return {'design': design, 'critic': critic}, [{'kind': 'revise', 'payload': payload}]
+
+
+def run_revise(payload, inputs):
+    result = inputs[-1]['result']
+    design = utils.concatenate_designs(result['design'], result['critic'], payload['run']['model'],
+                                       payload['run']['sampling'])
+    return {'design': design}, [{'kind': 'critique', 'payload': dict(payload, iteration=payload['iteration'] + 1)}]
+
+
+def run_plan(payload, inputs):
+    """
+    One coding job per task of the design, in the order of their dependencies and depending on the jobs
+    of the tasks it depends on only, so that independent tasks are coded in parallel, then the assembly of the program.
+    """
+    run, design = payload['run'], inputs[-1]['result']['design']
+    utils.save_design_to_file(design, run['folder'])
+    tasks = utils.parse_answer(design)
+    graph = design_graph.dependency_graph(tasks)
+    order = design_graph.topological_order(tasks, graph)
+    position = {task: i for i, task in enumerate(order)}
+    # the dependencies left out of a broken cycle come later in the order
+    follow_ups = [{'kind': 'code', 'payload': {'run': run, 'index': i, 'task': tasks[task]},
+                   'after': sorted(position[j] for j in graph[task] if position[j] < i)}
+                  for i, task in enumerate(order)]
+    follow_ups.append({'kind': 'assemble', 'payload': {'run': run}, 'after': list(range(len(tasks)))})
+    return {'design': design, 'tasks': len(tasks)}, follow_ups
+
+
+def run_code(payload, inputs):
+    run = payload['run']
+    context = '\n\n'.join(i['result']['code'] for i in inputs if i['kind'] == 'code')
+    design_names = set(re.findall(r"\w+", next(i for i in inputs if i['kind'] == 'plan')['result']['design']))
+    state = _state()
+    code, _ = generate_code.code_task(payload['task'], context, design_names, run['model'], state['snippets'],
+                                      state['index'], run['compact_context'], run['sampling'])
+    return {'index': payload['index'], 'code': code}, []
+
+
+def run_assemble(payload, inputs):
+    run = payload['run']
+    fragments = sorted((i['result'] for i in inputs if i['kind'] == 'code'), key=lambda r: r['index'])
+    code, _ = static_checker.gate('\n\n'.join(fragment['code'] for fragment in fragments))
+    utils.save_code_to_file(code, _version_path(run, 0), mode='w')
+    return {'version': 0}, [{'kind': 'repair', 'payload': {'run': run, 'version': 0}}]
+
+
+def run_repair(payload, inputs):
+    run, version = payload['run'], payload['version']
+    code, failures = static_checker.gate(utils.get_current_code(run['folder'], version=version))
+    generate_code.repair_program(code, failures, _version_path(run, version), run['model'], run['smoke_test'],
+                                 sampling=run['sampling'])
+    return {'version': version}, [{'kind': 'evaluate', 'payload': payload}]
+
+
+def run_improve(payload, inputs):
+    run, version = payload['run'], payload['version']
+    previous_code = utils.get_current_code(run['folder'], version=version - 1)
+    answer = utils.improve_code(run['prompt'], previous_code, run['model'], run['sampling'])
+    code, _ = static_checker.gate(utils.parse_code_output(answer))
+    utils.save_code_to_file(code, _version_path(run, version), mode='w')
+    return {'version': version}, [{'kind': 'repair', 'payload': payload}]
+
+
+def run_evaluate(payload, inputs):
+    """
+    Go on improving the code until it converges or the iterations are done, then save the final program.
+    """
+    run, version = payload['run'], payload['version']
+    similarity = None
+    if version > 0:
+        similarity = utils.code_similarity(utils.get_current_code(run['folder'], version=version - 1),
+                                           utils.get_current_code(run['folder'], version=version))
+    if version < run['improve_iterations'] and (similarity is None or similarity < run['similarity_threshold']):
+        return {'similarity': similarity}, [{'kind': 'improve', 'payload': dict(payload, version=version + 1)}]
+    final_path = f"{run['folder']}/generated_code.py"
+    utils.save_code_to_file(utils.get_current_code(run['folder'], version=version), final_path, mode='w')
+    return {'similarity': similarity, 'path': final_path}, []
+
+
+# the handlers of the kinds of jobs, each returning the result of the job and its follow-up jobs
+HANDLERS = {'design': run_design, 'critique': run_critique, 'revise': run_revise, 'plan': run_plan,
+            'code': run_code, 'assemble': run_assemble, 'repair': run_repair, 'improve': run_improve,
+            'evaluate': run_evaluate}
+
+
+def submit(queue, model, initial_prompt, design_iterations, project_name, folder_name='generated_scripts',
+           improve_iterations=5, similarity_threshold=0.95, smoke_test=True, compact_context=True, sampling=None,
+           deterministic=False):
+    """
+    Add a run of the pipeline to the queue, as its first job. Returns the id of the job.
+    """
+    folder = os.path.join(project_name, folder_name)
+    utils.make_directory(folder)
+    utils.erase_current_code(folder)
+    utils.erase_current_design(folder)
+    utils.erase_iterations(folder)
+    run = {'model': model, 'prompt': initial_prompt, 'folder': folder, 'design_iterations': design_iterations,
+           'improve_iterations': improve_iterations, 'similarity_threshold': similarity_threshold,
+           'smoke_test': smoke_test, 'compact_context': compact_context,
+           'sampling': utils.deterministic_sampling(sampling) if deterministic else sampling}
+    return queue.add('design', {'run': run})
+
+
+def work(path=QUEUE_PATH, lease=600, poll=1.0, until_idle=True):
+    """
+    Claim and run jobs until none is left to run, or forever if not until_idle.
+    """
+    queue = JobQueue(path)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    busy = False
+    while True:
+        job = queue.claim(worker, lease)
+        if job is None:
+            # the statistics of the snippet cache are written once the worker runs out of jobs
+            if busy and 'snippets' in worker_state:
+                worker_state['snippets'].save()
+            busy = False
+            if until_idle and not queue.runnable():
+                return
+            time.sleep(poll)
+            continue
+        log.info('%s runs job %d (%s)', worker, job['id'], job['kind'])
+        busy = True
+        try:
+            result, follow_ups = HANDLERS[job['kind']](job['payload'], job['inputs'])
+        except Exception:
+            queue.fail(job, worker, traceback.format_exc())
+        else:
+            queue.complete(job, worker, result, follow_ups)
+
+
+def work_process(path, until_idle, metrics_directory=None):
+    """
+    The work of a worker process, which flushes its log before it exits. With a metrics directory, its metrics
+    are exported there for the parent process, which serves them.
+    """
+    export = None
+    if metrics_directory:
+        export = metrics.export_periodically(os.path.join(metrics_directory, f'{os.getpid()}.json'),
+                                             metrics.interval())
+    try:
+        work(path, until_idle=until_idle)
+    finally:
+        if export:
+            export()
+        run_log.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Durable job queue of the generation pipeline.")
+    parser.add_argument('--queue', default=QUEUE_PATH, help="the SQLite file of the queue, shared by the workers")
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit_parser = commands.add_parser('submit')
+    submit_parser.add_argument('prompt')
+    submit_parser.add_argument('project_name')
+    submit_parser.add_argument('--model', default='gpt-4o')
+    submit_parser.add_argument('--design-iterations', type=int, default=5)
+    submit_parser.add_argument('--improve-iterations', type=int, default=5)
+    submit_parser.add_argument('--deterministic', action='store_true', help="pin the sampling of every call")
+    work_parser = commands.add_parser('work')
+    work_parser.add_argument('--processes', type=int, default=1)
+    work_parser.add_argument('--forever', action='store_true', help="wait for new jobs rather than exit when idle")
+    commands.add_parser('status')
+    args = parser.parse_args()
+    if args.command == 'submit':
+        print('job', submit(JobQueue(args.queue), args.model, args.prompt, args.design_iterations, args.project_name,
+                            improve_iterations=args.improve_iterations, deterministic=args.deterministic))
+    elif args.command == 'work':
+        metrics_directory = None
+        if metrics.enabled():
+            # the LLM calls are made by the workers, their metrics are rendered with those of this process
+            metrics_directory = os.path.join(utils.CACHE_DIR, 'worker_metrics', str(os.getpid()))
+            utils.make_directory(metrics_directory)
+            metrics.registry.include_workers(metrics_directory)
+        processes = [multiprocessing.Process(target=work_process,
+                                             args=(args.queue, not args.forever, metrics_directory))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        if metrics_directory:
+            # the depth of the queue is reported once, by this process
+            metrics.gauge_callback('code4me_queue_depth', lambda: pending_jobs(args.queue), queue='jobs')
+            metrics.start_from_environment()
+        for process in processes:
+            process.join()
+        if metrics_directory:
+            metrics.flush()
+            shutil.rmtree(metrics_directory, ignore_errors=True)
+    else:
+        print(json.dumps(JobQueue(args.queue).counts(), indent=4))
@@ -0,0 +1,16 @@
+import json
+import os
+import threading
+
+
+def write_json_atomic(path, data):
+    """
+    Write data to a JSON file, written aside then renamed over it, so that readers never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary_path, path)
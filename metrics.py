@@ -0,0 +1,252 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import json_store
+import run_log
+
+log = run_log.get_logger('metrics')
+
+# the descriptions and types of the metrics, in the Prometheus text format
+DESCRIPTIONS = {
+    'code4me_calls_total': ('counter', 'LLM calls made, per stage and model'),
+    'code4me_call_errors_total': ('counter', 'LLM calls that raised an error, per stage'),
+    'code4me_calls_in_flight': ('gauge', 'LLM calls waiting for their response'),
+    'code4me_tokens_total': ('counter', 'Tokens of the LLM calls, per kind (prompt or completion)'),
+    'code4me_tokens_per_second': ('gauge', 'Tokens of the LLM calls per second since the start of the process'),
+    'code4me_rate_limit_wait_seconds_total': ('counter', 'Time spent waiting to stay under the API rate limits'),
+    'code4me_call_latency_seconds': ('summary', 'Latency of the LLM calls per stage, over the recent calls'),
+    'code4me_cache_hit_rate': ('gauge', 'Hit rate of the caches, per cache'),
+    'code4me_queue_depth': ('gauge', 'Jobs waiting to run, per queue'),
+}
+QUANTILES = (0.5, 0.95, 0.99)
+# the settings of the endpoint and of the file, for the entry point only, not for the processes it starts
+ENVIRONMENT = ('CODE4ME_METRICS_PORT', 'CODE4ME_METRICS_FILE', 'CODE4ME_METRICS_INTERVAL')
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Metrics:
+    """
+    Counters, gauges and latency summaries of the process. Gauges can also be read from a callback when the
+    metrics are rendered, such as the hit rate of a cache. Latency percentiles are over the recent samples.
+    The metrics of worker processes, exported to the files of a directory, are rendered with a worker label.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.callbacks = {}
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.totals = defaultdict(lambda: [0, 0.0])
+        self.start_time = time.time()
+        self.worker_directory = None
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.values[name, _labels(labels)] += value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name, _labels(labels)] = value
+
+    def gauge_callback(self, name, callback, **labels):
+        with self.lock:
+            self.callbacks[name, _labels(labels)] = callback
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.samples[key].append(seconds)
+            self.totals[key][0] += 1
+            self.totals[key][1] += seconds
+
+    def collect(self):
+        """
+        The samples of the metrics of the process, by metric: lists of (sample name, labels, value).
+        """
+        with self.lock:
+            values = dict(self.values)
+            callbacks = dict(self.callbacks)
+            samples = {key: list(window) for key, window in self.samples.items()}
+            totals = {key: tuple(total) for key, total in self.totals.items()}
+        for key, callback in callbacks.items():
+            try:
+                values[key] = float(callback())
+            except Exception:
+                continue  # the owner of the callback is gone or broken, the metric is skipped
+        tokens = sum(value for (name, _), value in values.items() if name == 'code4me_tokens_total')
+        values['code4me_tokens_per_second', ()] = tokens / max(time.time() - self.start_time, 1e-9)
+        collected = {}
+        for (name, labels), value in sorted(values.items()):
+            collected.setdefault(name, []).append((name, labels, value))
+        for (name, labels), window in sorted(samples.items()):
+            for quantile in QUANTILES:
+                collected.setdefault(name, []).append(
+                    (name, labels + (('quantile', str(quantile)),), percentile(window, quantile)))
+            count, total = totals[name, labels]
+            collected[name] += [(f'{name}_count', labels, count), (f'{name}_sum', labels, total)]
+        return collected
+
+    def include_workers(self, directory):
+        """
+        Render the metrics the worker processes export to the directory along with those of this process.
+        """
+        self.worker_directory = directory
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        collected = self.collect()
+        paths = glob.glob(os.path.join(self.worker_directory, '*.json')) if self.worker_directory else []
+        for path in sorted(paths):
+            worker = os.path.splitext(os.path.basename(path))[0]
+            try:
+                with open(path) as file:
+                    exported = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, metric_samples in exported.items():
+                collected.setdefault(name, []).extend(
+                    (sample, tuple(map(tuple, labels)) + (('worker', worker),), value)
+                    for sample, labels, value in metric_samples)
+        text = []
+        for name, metric_samples in collected.items():
+            metric_lines = [f'{sample}{_format_labels(labels)} {value:g}' for sample, labels, value in metric_samples]
+            kind, description = DESCRIPTIONS.get(name, ('untyped', name))
+            text += [f'# HELP {name} {description}', f'# TYPE {name} {kind}'] + metric_lines
+        return '\n'.join(text) + '\n'
+
+
+registry = Metrics()
+inc, set_gauge, gauge_callback, observe = registry.inc, registry.set, registry.gauge_callback, registry.observe
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Expose the metrics at http://host:port/metrics from a background thread. Returns the server.
+    """
+    # imported here, the HTTP server is only needed by the entry points that serve the metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scraped every few seconds, not worth a line each time
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def flush_periodically(path, interval=30):
+    """
+    Write the metrics to a file every interval seconds from a background thread, replaced atomically,
+    in the format of the textfile collector of the Prometheus node exporter. Returns the function writing them once.
+    """
+    def flush():
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(registry.render())
+        os.replace(temporary_path, path)
+
+    def flush_forever():
+        while True:
+            flush()
+            time.sleep(interval)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    threading.Thread(target=flush_forever, daemon=True).start()
+    return flush
+
+
+def export_periodically(path, interval=30):
+    """
+    Export the metrics of a worker process to a JSON file every interval seconds from a background thread,
+    for its parent to render them (see Metrics.include_workers). Returns the function exporting them once,
+    to call when the worker ends.
+    """
+    def export():
+        json_store.write_json_atomic(path, registry.collect())
+
+    def export_forever():
+        while True:
+            export()
+            time.sleep(interval)
+    threading.Thread(target=export_forever, daemon=True).start()
+    return export
+
+
+def enabled():
+    return bool(os.environ.get('CODE4ME_METRICS_PORT') or os.environ.get('CODE4ME_METRICS_FILE'))
+
+
+def subprocess_environment(**variables):
+    """
+    The environment of a subprocess: that of this process without the metrics settings, so that it neither binds
+    the port again nor overwrites the metrics file, with the given variables.
+    """
+    return dict({name: value for name, value in os.environ.items() if name not in ENVIRONMENT}, **variables)
+
+
+started = {}
+start_lock = threading.Lock()
+
+
+def start_from_environment():
+    """
+    Start the endpoint on the port of CODE4ME_METRICS_PORT and the flush to the file of CODE4ME_METRICS_FILE,
+    if they are set, once per process. Called by the entry points, the generator, the daemon and the queue workers.
+    """
+    with start_lock:
+        port, path = os.environ.get('CODE4ME_METRICS_PORT'), os.environ.get('CODE4ME_METRICS_FILE')
+        if port and 'port' not in started:
+            started['port'] = None
+            try:
+                serve(int(port))
+            except OSError as error:
+                log.warning('metrics endpoint not started on port %s: %s', port, error)
+        if path and 'file' not in started:
+            started['file'] = flush_periodically(path, interval())
+
+
+def interval():
+    return float(os.environ.get('CODE4ME_METRICS_INTERVAL', '30'))
+
+
+def flush():
+    """
+    Write the metrics file now, if it is written, e.g. before the process exits.
+    """
+    if started.get('file'):
+        started['file']()
@@ -0,0 +1,73 @@
+import json
+import re
+
+# a small design, answered by the design stages whatever the prompt
+DESIGN = [
+    {"class": "Inventory",
+     "description": "Store named items with their quantity.",
+     "attributes": [{"name": "items", "type": "dict[str, int]"}],
+     "methods": [{"name": "add_item", "purpose": "Add a quantity of an item.",
+                  "parameters": [{"name": "name", "type": "str"}, {"name": "quantity", "type": "int"}]},
+                 {"name": "total", "purpose": "Return the total quantity of items.", "return": "int"}]},
+    {"function": "run",
+     "description": "Create an inventory, add a few items and print the total quantity.",
+     "return": "None"},
+]
+
+# the modules answered by the module designer
+MODULES = [
+    {"module": "inventory", "purpose": "Store items and their quantities.",
+     "interface": ["class Inventory: def add_item(self, name: str, quantity: int) -> None; def total(self) -> int"],
+     "depends_on": []},
+    {"module": "main", "purpose": "Run the program.", "interface": ["def run() -> None"],
+     "depends_on": ["inventory"]},
+]
+
+# the code given in the prompts of the stages that rewrite or fix code
+CODE_IN_PROMPT = re.compile(r"(?:current code|program|code) is as follows:\n(.*?)(?:\n\n(?=[A-Z])|\Z)", re.DOTALL)
+
+
+def _task(prompt):
+    # the task descriptor, a dictionary printed on one line in the coding prompts
+    for line in reversed(prompt.splitlines()):
+        if line.startswith('{') and line.endswith('}'):
+            return line
+    return ''
+
+
+def _class_code(task):
+    name = re.search(r"'class': '(\w+)'", task)
+    name = name.group(1) if name else 'Component'
+    methods = [m for m in re.findall(r"'name': '(\w+)', 'purpose'", task) if m != '__init__']
+    lines = [f"class {name}:", "    def __init__(self):", "        self.items = {}"]
+    for method in methods:
+        lines += ["", f"    def {method}(self, *args):", "        return len(self.items)"]
+    return '\n'.join(lines)
+
+
+def _function_code(task):
+    name = re.search(r"'(?:function|name)': '(\w+)'", task)
+    name = name.group(1) if name else 'helper'
+    if name == 'run':
+        return "def run():\n    print('ok')"
+    return f"def {name}(*args):\n    return None"
+
+
+def respond(stage, prompt):
+    """
+    Deterministic answer of a pipeline stage, so that the pipeline runs offline, quickly and reproducibly.
+    """
+    if stage in ('designer', 'adapt_design', 'concatenate_designs'):
+        return f"```json\n{json.dumps(DESIGN, indent=4)}\n```"
+    if stage == 'module_designer':
+        return f"```json\n{json.dumps(MODULES, indent=4)}\n```"
+    if stage == 'critic_design':
+        return "the design is okay as is"
+    if stage == 'class_coder':
+        return f"```python\n{_class_code(_task(prompt))}\n```"
+    if stage == 'function_coder':
+        return f"```python\n{_function_code(_task(prompt))}\n```"
+    if stage == 'workload_writer':
+        return "```python\nfor _ in range(100):\n    run()\n```"
+    match = CODE_IN_PROMPT.search(prompt)
+    return f"```python\n{match.group(1) if match else ''}\n```"
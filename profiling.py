@@ -0,0 +1,102 @@
+import ast
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+
+import metrics
+import run_log
+import static_checker
+
+log = run_log.get_logger('profiling')
+
+# runs the program module, then the workload (or the entry point) under cProfile until the time limit
+DRIVER = """
+import _thread, cProfile, os, runpy, sys, threading, traceback
+path, entry, workload_path, stats_path, time_limit = sys.argv[1:6]
+namespace = runpy.run_path(path, run_name='__profiled__')
+workload = compile(open(workload_path).read(), '<workload>', 'exec') if workload_path else None
+profiler = cProfile.Profile()
+timer = threading.Timer(float(time_limit), _thread.interrupt_main)
+timer.start()
+profiler.enable()
+try:
+    exec(workload, namespace) if workload else namespace[entry]()
+except KeyboardInterrupt:
+    pass  # the time limit is reached
+except BaseException:
+    traceback.print_exc()
+finally:
+    profiler.disable()
+    timer.cancel()
+    profiler.dump_stats(stats_path)
+    os._exit(0)
+"""
+
+# keys commonly read by console programs, fed on stdin when no workload is given
+SYNTHETIC_INPUT = "\n".join(["1", "a", "d", " ", "w", "s", "p", "p", "q"] * 50) + "\n"
+
+
+def profile_program(filepath, workload=None, entry='run', time_limit=20, top=5):
+    """
+    Profile the generated program on a workload, a script run in the namespace of the program,
+    or by calling its entry point with synthetic input if there is none.
+    Returns the top hotspots of the program, by own time, and the total profiled time.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        stats_path = os.path.join(directory, 'profile.stats')
+        workload_path = ''
+        if workload:
+            workload_path = os.path.join(directory, 'workload.py')
+            with open(workload_path, 'w') as file:
+                file.write(workload)
+        env = metrics.subprocess_environment(SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy')
+        command = [sys.executable, '-c', DRIVER, filepath, entry, workload_path, stats_path, str(time_limit)]
+        try:
+            result = subprocess.run(command, input=SYNTHETIC_INPUT, capture_output=True, text=True, env=env,
+                                    timeout=time_limit + 10)
+            if result.stderr:
+                log.debug('Profiled run output: %s', result.stderr[-2000:])
+        except subprocess.TimeoutExpired:
+            log.warning('Profiled run did not stop, no profile collected')
+            return [], 0.0
+        if not os.path.exists(stats_path):
+            return [], 0.0
+        stats = pstats.Stats(stats_path)
+    return hotspots(stats, filepath, top), stats.total_tt
+
+
+def hotspots(stats, filepath, top=5):
+    """
+    The functions of the program that take the most own time, with their source.
+    """
+    with open(filepath) as file:
+        code = file.read()
+    lines = code.splitlines()
+    try:
+        spans = {span[0]: span for span in static_checker.symbol_spans(ast.parse(code))}
+    except SyntaxError:
+        spans = {}
+    found = []
+    for (filename, lineno, function), (_, calls, own_time, cumulative_time, _) in stats.stats.items():
+        if os.path.abspath(filename) != os.path.abspath(filepath) or lineno not in spans:
+            continue
+        start, end, name = spans[lineno]
+        found.append({'name': name, 'calls': calls, 'own_time': own_time, 'cumulative_time': cumulative_time,
+                      'source': '\n'.join(lines[start - 1:end])})
+    found.sort(key=lambda hotspot: hotspot['own_time'], reverse=True)
+    return [hotspot for hotspot in found[:top] if hotspot['own_time'] > 0]
+
+
+def format_hotspots(found, total_time):
+    """
+    Describe the hotspots for a prompt: name, calls, timings and source of each.
+    """
+    parts = []
+    for hotspot in found:
+        share = 100 * hotspot['own_time'] / total_time if total_time else 0
+        parts.append(f"{hotspot['name']}: {hotspot['calls']} calls, {hotspot['own_time']:.3f} s own time "
+                     f"({share:.0f}% of the total), {hotspot['cumulative_time']:.3f} s cumulative\n"
+                     f"{hotspot['source']}")
+    return '\n\n'.join(parts)
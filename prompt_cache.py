@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+
+import json_store
+
+# a Mersenne prime larger than the 61 bits kept of the shingle hashes
+PRIME = (1 << 61) - 1
+
+
+def shingles(text, size=3):
+    """
+    The set of word n-grams of a text, lowercased.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class SemanticCache:
+    """
+    Cache of responses looked up by near-duplicate prompts rather than by exact match.
+    Prompts are fingerprinted with MinHash over word shingles, candidates are found with an LSH index
+    (bands of the signature), and a cached response is reused when the estimated Jaccard similarity
+    of the prompts reaches the threshold. Entries are evicted least recently used first.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle_size=3, max_entries=500, path=None):
+        assert num_perm % bands == 0, "num_perm must be a multiple of bands"
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.path = path
+        rng = random.Random(42)
+        self.permutations = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def signature(self, text):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') & PRIME
+                  for s in shingles(text, self.shingle_size)]
+        return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in self.permutations)
+
+    def _band_keys(self, namespace, signature):
+        return [(namespace, i, signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def lookup(self, text, namespace=''):
+        """
+        Return the cached response of the most similar prompt of the namespace, if similar enough, else None.
+        """
+        signature = self.signature(text)
+        with self.lock:
+            self.stats['lookups'] += 1
+            candidates = set()
+            for key in self._band_keys(namespace, signature):
+                candidates |= self.buckets.get(key, set())
+            best, best_similarity = None, 0.0
+            for entry_id in candidates:
+                other = self.entries[entry_id]['signature']
+                similarity = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+                if similarity > best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is None or best_similarity < self.threshold:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.entries.move_to_end(best)
+            return self.entries[best]['response']
+
+    def store(self, text, response, namespace=''):
+        signature = self.signature(text)
+        entry_id = hashlib.sha256(f"{namespace}\n{text}".encode()).hexdigest()
+        with self.lock:
+            if entry_id in self.entries:
+                self._remove(entry_id)
+            self.entries[entry_id] = {'namespace': namespace, 'signature': signature, 'response': response}
+            for key in self._band_keys(namespace, signature):
+                self.buckets.setdefault(key, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+        if self.path:
+            self.save()
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        for key in self._band_keys(entry['namespace'], entry['signature']):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def hit_rate(self):
+        return self.stats['hits'] / self.stats['lookups'] if self.stats['lookups'] else 0.0
+
+    def summary(self):
+        return dict(self.stats, size=len(self.entries), hit_rate=round(self.hit_rate(), 3))
+
+    def save(self):
+        with self.lock:
+            entries = [dict(entry, id=entry_id, signature=list(entry['signature']))
+                       for entry_id, entry in self.entries.items()]
+        json_store.write_json_atomic(self.path, {'num_perm': self.num_perm, 'entries': entries})
+
+    def load(self):
+        with open(self.path) as file:
+            data = json.load(file)
+        if data.get('num_perm') != self.num_perm:
+            return  # signatures of another configuration cannot be compared
+        with self.lock:
+            for entry in data['entries']:
+                entry_id = entry.pop('id')
+                entry['signature'] = tuple(entry['signature'])
+                self.entries[entry_id] = entry
+                for key in self._band_keys(entry['namespace'], entry['signature']):
+                    self.buckets.setdefault(key, set()).add(entry_id)
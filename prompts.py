@@ -0,0 +1,135 @@
+import os
+import threading
+
+# the instructions of the coding stages, the same text for every call of a stage, so that they are always
+# the start of its prompts; the parts that change follow, referred to by their titles
+CLASS_CODER = (
+    "You are a programmer tasked with adding a new Python class to an existing codebase. "
+    "The current code and the new class to implement are given below; the new class is described in a "
+    "JSON-like dictionary, which includes its name, description, attributes, and methods.\n\n"
+    "Your task is to:\n"
+    "1. Add the new class to the provided codebase without modifying the existing code.\n"
+    "2. Fully implement the class, including the `__init__` method and all described methods.\n"
+    "3. Include inline comments or docstrings within the class to explain its purpose and functionality.\n\n"
+    "Output requirements:\n"
+    "- Only return the code for the new class without any additional comments or explanations outside the code.\n"
+    "- Ensure proper formatting and indentation for Python code.\n"
+    "- You cannot use placeholders such as 'add specific logic here'; "
+    "you must fully implement the logic described in the class descriptor.\n"
+    "dont be too much verbose"
+)
+FUNCTION_CODER = (
+    "You are a programmer tasked with adding a new Python function or method to an existing codebase. "
+    "The current code and the goal of the new function or method are given below.\n\n"
+    "The task is to:\n"
+    "1. Implement a function or method that achieves the goal.\n"
+    "2. Add the function or method to the existing code without modifying the current code.\n"
+    "3. If the function is part of a class, ensure it is correctly formatted and indented as a method within the class.\n\n"
+    "Output requirements:\n"
+    "- Only return the code for the new function or method, with no additional comments or explanations outside the code.\n"
+    "- Ensure proper formatting and indentation for Python code.\n"
+    "- Include inline comments or a docstring to describe the function's purpose and behavior.\n"
+    "- Fully implement the logic for the function; avoid placeholders like 'add specific logic here."
+    "dont be too much verbose'"
+)
+IMPROVE_CODE = (
+    "You are a critic tasked with improving a codebase to better achieve a programming goal. "
+    "The user's goal and the current code are given below.\n\n"
+    "Your task is to:\n"
+    "1. Rewrite the code to improve its overall quality, readability, and effectiveness in achieving the specified goal.\n"
+    "2. You may:\n"
+    "   - Reorganize the code, changing the order of classes, functions, or methods if needed.\n"
+    "   - Add new functions, methods, or classes to enhance functionality.\n"
+    "   - Remove redundant or unnecessary parts of the code.\n"
+    "   - Fully implement any methods or functions that are currently incomplete.\n"
+    "3. Ensure the code is well-structured and adheres to Python best practices.\n"
+    "4. Include inline comments or docstrings to explain the purpose and functionality of classes, functions, or methods where relevant.\n\n"
+    "Output requirements:\n"
+    "- Return only the improved code, with no additional comments or explanations outside the code.\n"
+    "- Ensure proper formatting, indentation, and a clear, logical flow in the final output."
+)
+WORKLOAD_WRITER = (
+    "You are a programmer tasked with writing a benchmark workload for a Python program. "
+    "The user's goal for the program and the program are given below.\n\n"
+    "Your task is to write a short script that exercises the main code paths of the program with a realistic, "
+    "scaled up amount of data (e.g. many game objects, many database rows, many requests), "
+    "so that a profiler can find its hotspots.\n"
+    "The script is executed in the namespace of the program: all its classes and functions are available "
+    "without importing them.\n"
+    "The script must not wait for user input, open windows, start servers or use the network, "
+    "and it must finish within a few seconds.\n\n"
+    "Output requirements:\n"
+    "- Return only the script, with no additional comments or explanations outside the code."
+)
+IMPROVE_PERFORMANCE = (
+    "You are a programmer tasked with making a program faster without changing what it does. "
+    "The user's goal, the current code and its hotspots are given below: the program was profiled on "
+    "a representative workload, and its hotspots are listed with their source.\n\n"
+    "Your task is to:\n"
+    "1. Make these hotspots faster, e.g. with better algorithms and data structures, fewer nested loops, "
+    "batched database or I/O calls, caching of repeated computations.\n"
+    "2. Keep the behaviour, the public classes, functions and their signatures unchanged.\n"
+    "3. Leave the rest of the code as it is.\n\n"
+    "Output requirements:\n"
+    "- Return only the full improved code, with no additional comments or explanations outside the code.\n"
+    "- Ensure proper formatting and indentation for Python code."
+)
+REPAIR_CODE = (
+    "You are a programmer tasked with fixing a piece of Python code. "
+    "The code, the stubs of the definitions it relies on if any, and the problems reported for it are given below.\n\n"
+    "Your task is to fix these problems, and only them, without changing the rest of the code.\n\n"
+    "Output requirements:\n"
+    "- Return only the fixed code, with no additional comments or explanations outside the code.\n"
+    "- Ensure proper formatting and indentation for Python code."
+)
+
+
+def render(instructions, context=(), delta=()):
+    """
+    A prompt laid out for the prompt caching of the providers, which reuse the longest prefix shared with a
+    recent prompt: the static instructions first, then the context that changes slowly during a run
+    (the goal, the design, the code written so far), then what is specific to the call.
+    Context and delta are (title, text) pairs; empty texts are left out.
+    """
+    parts = [instructions]
+    for title, text in list(context) + list(delta):
+        if text:
+            parts.append(f"{title}:\n{text}")
+    return "\n\n".join(parts)
+
+
+class PrefixReport:
+    """
+    Length of the prefix each prompt shares with the previous prompt of the same stage, the part a provider
+    can serve from its prompt cache. Providers only cache prefixes from about min_tokens tokens.
+    """
+
+    def __init__(self, min_tokens=1024):
+        self.min_tokens = min_tokens
+        self.lock = threading.Lock()
+        self.previous = {}
+        self.stats = {}
+
+    def record(self, stage, prompt):
+        """
+        Record a prompt, returns the length in characters of the prefix it shares with the previous one.
+        """
+        with self.lock:
+            previous = self.previous.get(stage, "")
+            shared = len(os.path.commonprefix([previous, prompt]))
+            self.previous[stage] = prompt
+            stats = self.stats.setdefault(stage, {'calls': 0, 'prompt_chars': 0, 'shared_chars': 0, 'cacheable': 0})
+            stats['calls'] += 1
+            stats['prompt_chars'] += len(prompt)
+            stats['shared_chars'] += shared
+            # about 4 characters per token
+            stats['cacheable'] += shared // 4 >= self.min_tokens
+            return shared
+
+    def summary(self):
+        with self.lock:
+            return {stage: dict(stats, shared_ratio=round(stats['shared_chars'] / max(stats['prompt_chars'], 1), 3))
+                    for stage, stats in self.stats.items()}
+
+
+prefix_report = PrefixReport()
@@ -0,0 +1,193 @@
+import ast
+import os
+import re
+import subprocess
+import sys
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import run_log
+import static_checker
+import utils
+
+log = run_log.get_logger('repair')
+
+
+def smoke_test(filepath, timeout=20):
+    """
+    Execute the generated module, without its __main__ block, in a separate process.
+    Returns the traceback if it fails, an empty string otherwise (or if it runs longer than the timeout).
+    """
+    command = [sys.executable, "-c", "import runpy, sys; runpy.run_path(sys.argv[1], run_name='__smoke_test__')",
+               filepath]
+    try:
+        # no stdin: a module reading input at import fails at once rather than waiting on the user's terminal
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True,
+                                env=metrics.subprocess_environment(), timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return ""
+    return result.stderr if result.returncode != 0 else ""
+
+
+def diagnostics_from_traceback(traceback_text, filepath):
+    """
+    Turn a traceback into a diagnostic located at the deepest frame that belongs to the generated file.
+    """
+    frames = re.findall(r'File "(.+?)", line (\d+)', traceback_text)
+    frames = [int(line) for path, line in frames if os.path.basename(path) == os.path.basename(filepath)]
+    lines = [line for line in traceback_text.strip().splitlines() if line.strip()]
+    if not lines:
+        return []
+    lineno = frames[-1] if frames else None
+    return [static_checker.diagnostic('runtime', 'error', lines[-1].strip(), lineno)]
+
+
+def _text_block(lines, lineno):
+    # the top level block around a line, found from indentation only, for code that does not parse
+    start = lineno
+    while start > 1 and (not lines[start - 1].strip() or lines[start - 1][0].isspace()):
+        start -= 1
+    while start > 1 and lines[start - 2].startswith('@'):
+        start -= 1
+    end = lineno
+    while end < len(lines) and (not lines[end].strip() or lines[end][0].isspace()):
+        end += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return start, end
+
+
+def locate(code, diagnostic):
+    """
+    Return the (start line, end line, name) of the smallest class or function enclosing the diagnostic,
+    or None if it is at module level.
+    """
+    lineno = diagnostic['lineno']
+    if lineno is None:
+        return None
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        name = static_checker.top_level_symbol(code, lineno)
+        if name is None:
+            return None
+        start, end = _text_block(code.splitlines(), lineno)
+        return start, end, name
+    return static_checker.enclosing_symbol(static_checker.symbol_spans(tree), lineno)
+
+
+def stub(node):
+    # signature, docstring and attributes of a definition, with the bodies left out
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        body = [ast.Expr(ast.Constant(...))]
+        docstring = ast.get_docstring(node)
+        if docstring:
+            body.insert(0, ast.Expr(ast.Constant(docstring.splitlines()[0])))
+        return ast.unparse(type(node)(**dict(vars(node), body=body)))
+    members = []
+    attributes = []
+    for stmt in node.body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            members.append(stub(stmt))
+        elif isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+            members.append(ast.unparse(stmt))
+    for child in ast.walk(node):
+        if isinstance(child, ast.Attribute) and isinstance(child.ctx, ast.Store) \
+                and isinstance(child.value, ast.Name) and child.value.id == 'self' and child.attr not in attributes:
+            attributes.append(child.attr)
+    header = ast.unparse(ast.ClassDef(name=node.name, bases=node.bases, keywords=node.keywords,
+                                      body=[ast.Pass()], decorator_list=node.decorator_list)).splitlines()[:-1]
+    if attributes:
+        header.append(f"    # instance attributes: {', '.join(attributes)}")
+    return '\n'.join(header + [textwrap.indent(member, '    ') for member in members or ['...']])
+
+
+def dependency_stubs(code, start, end, related=()):
+    """
+    Stubs of the module level definitions that the lines [start, end] refer to, the enclosing class included,
+    and of the related ones, e.g. found by a symbol index.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return ""
+    words = set(re.findall(r"\w+", '\n'.join(code.splitlines()[start - 1:end])))
+    stubs = []
+    for node in tree.body:
+        if not isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if start <= node.lineno and node.end_lineno <= end:
+            continue  # the symbol being repaired itself
+        if node.name in words or node.name in related or node.lineno <= start <= node.end_lineno:
+            stubs.append(stub(node))
+    imports = [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    if imports:
+        stubs.insert(0, '\n'.join(imports))
+    return '\n\n'.join(stubs)
+
+
+def _repair_symbol(code, span, problems, model, related=(), sampling=None):
+    start, end, name = span
+    lines = code.splitlines()
+    source = '\n'.join(lines[start - 1:end])
+    indent = re.match(r"\s*", lines[start - 1]).group(0)
+    context = dependency_stubs(code, start, end, related)
+    fixed = utils.repair_code(textwrap.dedent(source), problems, model, context=context, sampling=sampling)
+    fixed = textwrap.dedent(utils.parse_code_output(fixed)).strip('\n')
+    return textwrap.indent(fixed, indent)
+
+
+def repair(code, diagnostics, model, max_workers=4, index=None, sampling=None):
+    """
+    Repair each failing class or function on its own, the smallest one enclosing each diagnostic,
+    with only the stubs of what it depends on as context, and splice the results back into the code.
+    With a symbol index, the stubs also include the symbols most relevant to each failure.
+    Independent symbols are repaired in parallel. Returns the repaired code and the names of the repaired symbols.
+    """
+    groups = {}
+    for d in diagnostics:
+        span = locate(code, d)
+        if span is None:
+            log.warning('Cannot locate a symbol to repair for: %s', static_checker.format_diagnostics([d]))
+            continue
+        groups.setdefault(span, []).append(d)
+    # a symbol inside another failing symbol is repaired with it
+    for span in sorted(groups, key=lambda s: s[0] - s[1]):
+        outer = [other for other in groups if other != span and other[0] <= span[0] and span[1] <= other[1]]
+        if outer:
+            groups[outer[0]].extend(groups.pop(span))
+    if not groups:
+        return code, []
+
+    spans = sorted(groups)
+    problems = [static_checker.format_diagnostics(groups[span]) for span in spans]
+    related = [[] for _ in spans]
+    if index is not None:
+        index.sync(code)
+        lines = code.splitlines()
+        queries = ['\n'.join(lines[start - 1:end]) + '\n' + text for (start, end, _), text in zip(spans, problems)]
+        related = [[name for name, _ in found] for found in index.query_many(queries, k=3)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(utils.in_context(_repair_symbol), code, span, text, model, names, sampling)
+                   for span, text, names in zip(spans, problems, related)]
+        results = [future.result() for future in futures]
+
+    try:
+        ast.parse(code)
+        parsed = True
+    except SyntaxError:
+        parsed = False
+    lines = code.splitlines()
+    repaired = []
+    for (start, end, name), fixed in sorted(zip(spans, results), reverse=True):
+        candidate = lines[:start - 1] + fixed.splitlines() + lines[end:]
+        if parsed:
+            try:
+                ast.parse('\n'.join(candidate))
+            except SyntaxError:
+                log.warning('Discarding the repair of %s that does not parse', name)
+                continue
+        lines = candidate
+        repaired.append(name)
+    return '\n'.join(lines) + '\n', repaired[::-1]
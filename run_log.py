@@ -0,0 +1,113 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+# the full log, as JSON lines, rotated by size
+LOG_PATH = os.environ.get("CODE4ME_LOG", os.path.join(os.environ.get("CODE4ME_CACHE_DIR", ".code4me_cache"),
+                                                      "code4me.log"))
+# the level of the console, the log file gets everything
+CONSOLE_LEVEL = os.environ.get("CODE4ME_LOG_LEVEL", "INFO").upper()
+# the longest message shown in full on the console
+PREVIEW_CHARS = int(os.environ.get("CODE4ME_LOG_PREVIEW", "300"))
+
+setup_lock = threading.Lock()
+listener = None
+
+
+class PreviewFormatter(logging.Formatter):
+    """
+    Console format: the message cut to a preview, designs and code are in the log file in full.
+    """
+
+    def format(self, record):
+        message = record.getMessage()
+        if len(message) > PREVIEW_CHARS:
+            message = f"{message[:PREVIEW_CHARS]}... [{len(message) - PREVIEW_CHARS} more chars in {LOG_PATH}]"
+        return f"{record.levelname.lower()} {record.name.split('.', 1)[-1]}: {message}"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Log file format: one JSON object per record, with the fields given as extra={'fields': {...}}.
+    """
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                 'thread': record.threadName, 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StartingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler of the code4me loggers, which starts the thread writing out the records on the first record,
+    so that importing the generator creates no log file and starts no thread.
+    """
+
+    def emit(self, record):
+        if listener is None:
+            _start(self)
+        super().emit(record)
+
+
+def _start(handler):
+    """
+    Send the records of the code4me loggers through a queue to a background thread, which writes them
+    to the console and to the rotating log file, so that logging never waits on a slow terminal or disk.
+    """
+    global listener
+    with setup_lock:
+        if listener is not None:
+            return
+        directory = os.path.dirname(LOG_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        console = logging.StreamHandler()
+        console.setLevel(CONSOLE_LEVEL)
+        console.setFormatter(PreviewFormatter())
+        log_file = logging.handlers.RotatingFileHandler(LOG_PATH, maxBytes=10 * 1024 * 1024, backupCount=5,
+                                                        encoding='utf-8')
+        log_file.setFormatter(JsonFormatter())
+        handler.queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(handler.queue, console, log_file, respect_handler_level=True)
+        listener.start()
+
+
+def stop():
+    """
+    Write out the records still queued and stop the background thread. Called at exit, and at the end of
+    the processes that exit without running the exit handlers, such as multiprocessing workers.
+    """
+    global listener
+    with setup_lock:
+        if listener is not None:
+            listener.stop()
+            listener = None
+
+
+def _after_fork():
+    # the thread of the listener does not survive a fork, the child starts its own on its first record
+    global listener, setup_lock
+    setup_lock = threading.Lock()
+    listener = None
+
+
+root = logging.getLogger('code4me')
+root.setLevel(logging.DEBUG)
+root.propagate = False
+root.addHandler(StartingQueueHandler(queue.SimpleQueue()))
+atexit.register(stop)
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_logger(name):
+    """
+    The logger of a module of the generator.
+    """
+    return logging.getLogger(f'code4me.{name}')
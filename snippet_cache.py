@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import json_store
+
+# spellings of the same types in the designs
+TYPE_ALIASES = {'integer': 'int', 'string': 'str', 'boolean': 'bool', 'double': 'float', 'dictionary': 'dict',
+                'array': 'list', 'none': 'None', 'nonetype': 'None', 'void': 'None'}
+# keys whose values are names, compared lowercased
+NAME_KEYS = {'name', 'class', 'function', 'method'}
+# keys whose values are types
+TYPE_KEYS = {'type', 'return', 'returns', 'return_type', 'return_value'}
+# keys of lists whose order does not matter
+UNORDERED_KEYS = {'attributes', 'methods'}
+
+
+def normalize_type(value):
+    value = re.sub(r"\s+|typing\.", "", value)
+    return re.sub(r"[A-Za-z_]+", lambda m: TYPE_ALIASES.get(m.group(0).lower(), m.group(0).lower()), value)
+
+
+def normalize_task(task, key=None):
+    """
+    Canonical form of a task of the design: keys lowercased and sorted, names lowercased,
+    types spelled the same way, whitespace collapsed, attributes and methods in any order.
+    """
+    if isinstance(task, dict):
+        return {str(k).lower(): normalize_task(v, str(k).lower()) for k, v in sorted(task.items(), key=lambda i: str(i[0]).lower())}
+    if isinstance(task, (list, tuple)):
+        items = [normalize_task(item, key) for item in task]
+        if key in UNORDERED_KEYS:
+            items.sort(key=lambda item: json.dumps(item, sort_keys=True))
+        return items
+    if isinstance(task, str):
+        text = ' '.join(task.split())
+        if key in TYPE_KEYS:
+            return normalize_type(text)
+        return text.lower() if key in NAME_KEYS else text
+    return task
+
+
+def task_key(task):
+    return hashlib.sha256(json.dumps(normalize_task(task), sort_keys=True).encode()).hexdigest()
+
+
+class SnippetCache:
+    """
+    Persistent cache of the validated implementations of design tasks, keyed by the normalized task,
+    so that a recurring task is implemented without any LLM call. Bounded, least recently used entries go first.
+    The file is written when an entry is stored; the statistics and the uses of the lookups are written by save(),
+    once per run.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.stats = {'lookups': 0, 'hits': 0, 'stores': 0, 'evictions': 0}
+        self.clock = 0
+        if os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            self.entries, self.stats = data['entries'], data['stats']
+            self.clock = max([entry['last_used'] for entry in self.entries.values()], default=0)
+
+    def get(self, task):
+        with self.lock:
+            self.stats['lookups'] += 1
+            entry = self.entries.get(task_key(task))
+            if entry is not None:
+                self.stats['hits'] += 1
+                self.clock += 1
+                entry['last_used'] = self.clock
+                entry['uses'] += 1
+        return entry['code'] if entry is not None else None
+
+    def put(self, task, code):
+        with self.lock:
+            self.clock += 1
+            self.entries[task_key(task)] = {'code': code, 'last_used': self.clock, 'uses': 0}
+            self.stats['stores'] += 1
+            while len(self.entries) > self.max_entries:
+                del self.entries[min(self.entries, key=lambda k: self.entries[k]['last_used'])]
+                self.stats['evictions'] += 1
+        self.save()
+
+    def hit_rate(self):
+        return self.stats['hits'] / self.stats['lookups'] if self.stats['lookups'] else 0.0
+
+    def summary(self):
+        return dict(self.stats, size=len(self.entries), hit_rate=round(self.hit_rate(), 3))
+
+    def save(self):
+        with self.lock:
+            json_store.write_json_atomic(self.path, {'entries': self.entries, 'stats': self.stats})
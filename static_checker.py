@@ -0,0 +1,468 @@
+import ast
+import builtins
+import re
+import symtable
+import textwrap
+
+# names that are always defined at module level
+BUILTIN_NAMES = set(dir(builtins)) | {'__file__', '__name__', '__doc__', '__spec__', '__loader__',
+                                      '__package__', '__builtins__', '__path__'}
+
+
+def diagnostic(kind, severity, message, lineno=None, symbol=None):
+    return {'kind': kind, 'severity': severity, 'message': message, 'lineno': lineno, 'symbol': symbol}
+
+
+def symbol_spans(tree):
+    """
+    List the (start line, end line, qualified name) of every class and function in the tree, decorators included.
+    """
+    spans = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = f"{prefix}{child.name}"
+                start = min([child.lineno] + [d.lineno for d in child.decorator_list])
+                spans.append((start, child.end_lineno, name))
+                visit(child, f"{name}.")
+            else:
+                visit(child, prefix)
+
+    visit(tree, "")
+    return spans
+
+
+def enclosing_symbol(spans, lineno):
+    """
+    Return the span of the smallest class or function containing the line, or None at module level.
+    """
+    best = None
+    for span in spans:
+        if lineno is not None and span[0] <= lineno <= span[1]:
+            if best is None or span[1] - span[0] < best[1] - best[0]:
+                best = span
+    return best
+
+
+def _scope_nodes(tree):
+    # map (name, lineno) of function and class scopes to their ast node, as symtable reports them
+    nodes = {}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            nodes[(node.name, node.lineno)] = node
+    return nodes
+
+
+def _first_load(node, name):
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id == name and isinstance(child.ctx, ast.Load):
+            return child.lineno
+    return getattr(node, 'lineno', None)
+
+
+def check_undefined_names(code, tree, known_names=()):
+    """
+    Report names that are read but never bound, neither in their scope nor at module level nor in builtins.
+    """
+    if any(isinstance(node, ast.ImportFrom) and any(a.name == '*' for a in node.names) for node in ast.walk(tree)):
+        return []
+    table = symtable.symtable(code, '<generated>', 'exec')
+    defined = {s.get_name() for s in table.get_symbols() if s.is_local()} | BUILTIN_NAMES | set(known_names)
+    scopes = [table]
+    for scope in scopes:
+        scopes.extend(scope.get_children())
+        for symbol in scope.get_symbols():
+            if symbol.is_declared_global() and symbol.is_assigned():
+                defined.add(symbol.get_name())
+
+    spans = symbol_spans(tree)
+    nodes = _scope_nodes(tree)
+    diagnostics = []
+    reported = set()
+    for scope in scopes:
+        for symbol in scope.get_symbols():
+            name = symbol.get_name()
+            if not symbol.is_referenced() or name in defined:
+                continue
+            if scope.get_type() != 'module' and not symbol.is_global():
+                continue
+            node = nodes.get((scope.get_name(), scope.get_lineno()), tree)
+            lineno = _first_load(node, name)
+            span = enclosing_symbol(spans, lineno)
+            key = (name, span)
+            if key in reported:
+                continue
+            reported.add(key)
+            diagnostics.append(diagnostic('undefined-name', 'error', f"undefined name '{name}'", lineno,
+                                          span[2] if span else None))
+    return diagnostics
+
+
+def _import_bindings(node):
+    # (bound name, origin) for every alias of an import statement
+    bindings = []
+    for alias in node.names:
+        if isinstance(node, ast.Import):
+            # import a.b binds a, but also loads a.b: it is not the same import as import a
+            bound = alias.asname or alias.name.split('.')[0]
+            origin = alias.name
+        else:
+            bound = alias.asname or alias.name
+            origin = f"{'.' * node.level}{node.module or ''}.{alias.name}"
+        bindings.append((bound, origin))
+    return bindings
+
+
+def check_imports(tree):
+    """
+    Report module level imports that are never used, or that bind the same name to the same object twice.
+    """
+    used = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+    for node in tree.body:
+        # names exported through __all__ count as used
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__all__' for t in node.targets):
+            used |= {c.value for c in ast.walk(node.value) if isinstance(c, ast.Constant) and isinstance(c.value, str)}
+
+    diagnostics = []
+    origins, first_line = {}, {}
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)) or getattr(node, 'module', None) == '__future__':
+            continue
+        for bound, origin in _import_bindings(node):
+            if origins.get(bound) == origin:
+                diagnostics.append(diagnostic('duplicate-import', 'warning',
+                                              f"'{bound}' is already imported line {first_line[bound]}",
+                                              node.lineno))
+                continue
+            origins[bound] = origin
+            first_line[bound] = node.lineno
+            if bound not in used:
+                diagnostics.append(diagnostic('unused-import', 'warning', f"'{bound}' is imported but unused",
+                                              node.lineno))
+    return diagnostics
+
+
+def check_duplicate_classes(tree):
+    diagnostics = []
+    first_line = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            if node.name in first_line:
+                diagnostics.append(diagnostic('duplicate-class', 'warning',
+                                              f"class '{node.name}' is already defined line {first_line[node.name]}",
+                                              node.lineno, node.name))
+            else:
+                first_line[node.name] = node.lineno
+    return diagnostics
+
+
+def _own_attributes(node):
+    # methods, class attributes and every self.<attr> assigned in the class body
+    attributes = set()
+    for stmt in node.body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            attributes.add(stmt.name)
+        elif isinstance(stmt, ast.Assign):
+            attributes |= {n.id for t in stmt.targets for n in ast.walk(t) if isinstance(n, ast.Name)}
+        elif isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name):
+            attributes.add(stmt.target.id)
+    for child in ast.walk(node):
+        if isinstance(child, ast.Attribute) and isinstance(child.ctx, ast.Store) \
+                and isinstance(child.value, ast.Name) and child.value.id in ('self', 'cls'):
+            attributes.add(child.attr)
+        if isinstance(child, ast.Call) and isinstance(child.func, ast.Name) and child.func.id == 'setattr':
+            return None
+    if attributes & {'__getattr__', '__getattribute__'}:
+        return None
+    return attributes
+
+
+def class_attributes(tree):
+    """
+    Map every module level class whose bases are all known to the attributes it resolves,
+    inherited ones and the ones set by its subclasses included. Classes with unknown bases are left out.
+    A class defined several times (one class per generated method) has the attributes of all its definitions.
+    """
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            definitions.setdefault(node.name, []).append(node)
+    bases = {name: [base for node in nodes for base in node.bases] for name, nodes in definitions.items()}
+    own = {}
+    for name, nodes in definitions.items():
+        attributes = [_own_attributes(node) for node in nodes]
+        own[name] = None if None in attributes else set().union(*attributes)
+
+    def resolve(name, visiting):
+        if own[name] is None or name in visiting:
+            return None
+        attributes = set(own[name])
+        for base in bases[name]:
+            if isinstance(base, ast.Name) and base.id == 'object':
+                continue
+            if not isinstance(base, ast.Name) or base.id not in definitions:
+                return None
+            inherited = resolve(base.id, visiting | {name})
+            if inherited is None:
+                return None
+            attributes |= inherited
+        return attributes
+
+    resolved = {name: resolve(name, set()) for name in definitions}
+    # a base class method may use an attribute that only its subclasses set
+    for name in definitions:
+        for base in bases[name]:
+            if isinstance(base, ast.Name) and resolved.get(base.id) is not None and own[name] is not None:
+                resolved[base.id] |= own[name]
+    return {name: attributes for name, attributes in resolved.items() if attributes is not None}
+
+
+def check_attributes(tree, known_names=()):
+    """
+    Report self.<attr> and ClassName.<attr> reads that no known class defines.
+    """
+    attributes = {name: resolved | set(known_names) for name, resolved in class_attributes(tree).items()}
+    diagnostics = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef) or node.name not in attributes:
+            continue
+        for method in node.body:
+            if not isinstance(method, (ast.FunctionDef, ast.AsyncFunctionDef)) or not method.args.args:
+                continue
+            if any(isinstance(d, ast.Name) and d.id == 'staticmethod' for d in method.decorator_list):
+                continue
+            receiver = method.args.args[0].arg
+            reported = set()
+            for child in ast.walk(method):
+                if isinstance(child, ast.Attribute) and isinstance(child.ctx, ast.Load) \
+                        and isinstance(child.value, ast.Name) and child.value.id == receiver \
+                        and child.attr not in attributes[node.name] and child.attr not in reported \
+                        and not (child.attr.startswith('__') and child.attr.endswith('__')):
+                    reported.add(child.attr)
+                    diagnostics.append(diagnostic('unknown-attribute', 'error',
+                                                  f"'{node.name}' has no attribute '{child.attr}'",
+                                                  child.lineno, f"{node.name}.{method.name}"))
+    spans = symbol_spans(tree)
+    for child in ast.walk(tree):
+        if isinstance(child, ast.Attribute) and isinstance(child.ctx, ast.Load) \
+                and isinstance(child.value, ast.Name) and child.value.id in attributes \
+                and child.attr not in attributes[child.value.id] \
+                and not (child.attr.startswith('__') and child.attr.endswith('__')):
+            span = enclosing_symbol(spans, child.lineno)
+            diagnostics.append(diagnostic('unknown-attribute', 'error',
+                                          f"'{child.value.id}' has no attribute '{child.attr}'",
+                                          child.lineno, span[2] if span else None))
+    return diagnostics
+
+
+def _check(code, known_names=()):
+    try:
+        compile(code, '<generated>', 'exec')
+    except (SyntaxError, ValueError) as e:
+        lineno = getattr(e, 'lineno', None)
+        return [diagnostic('syntax', 'error', f"{type(e).__name__}: {getattr(e, 'msg', e)}", lineno,
+                           top_level_symbol(code, lineno))]
+    tree = ast.parse(code)
+    return (check_undefined_names(code, tree, known_names) + check_imports(tree)
+            + check_duplicate_classes(tree) + check_attributes(tree, known_names))
+
+
+def top_level_symbol(code, lineno):
+    """
+    Name of the top level class or function containing a line, found from the source text only
+    so that it also works on code that does not parse.
+    """
+    if lineno is None:
+        return None
+    name = None
+    for i, line in enumerate(code.splitlines()[:lineno], start=1):
+        match = re.match(r"(?:async\s+)?(?:def|class)\s+(\w+)", line)
+        if match:
+            name = match.group(1)
+        elif line.strip() and not line[0].isspace() and not line.lstrip().startswith(('#', '@', ')', ']', '}')):
+            name = None
+    return name
+
+
+def check_code(code, context='', known_names=()):
+    """
+    Statically check the code, optionally as a fragment appended to the context (the code written so far).
+    Returns a list of diagnostics, i.e. dictionaries with kind, severity, message, lineno and symbol.
+    With a context, only the diagnostics of the fragment are returned, with line numbers relative to it.
+    known_names are names and attributes to consider defined, e.g. the ones of the design not coded yet.
+    """
+    if not context.strip():
+        return _check(code, known_names)
+    prefix = context.rstrip('\n') + '\n\n'
+    offset = prefix.count('\n')
+    try:
+        compile(context, '<context>', 'exec')
+    except (SyntaxError, ValueError):
+        # the context is broken itself: check the fragment alone, trusting any name found in the context
+        known_names = set(known_names) | set(re.findall(r"\w+", context))
+        return [d for d in _check(code, known_names) if d['kind'] != 'unknown-attribute']
+    diagnostics = []
+    for d in _check(prefix + code, known_names):
+        if d['lineno'] is not None and d['lineno'] > offset:
+            diagnostics.append(dict(d, lineno=d['lineno'] - offset))
+    return diagnostics
+
+
+def _segment(lines, node):
+    start = min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])])
+    return textwrap.dedent('\n'.join(lines[start - 1:node.end_lineno]))
+
+
+def _member_key(stmt):
+    if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return stmt.name
+    if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+        return stmt.targets[0].id
+    if isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name):
+        return stmt.target.id
+    if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str):
+        return '__doc__'
+    return None
+
+
+def _shares_lines(nodes):
+    # statements written on the same line (e.g. "x = 1; y = 2") cannot be moved line by line
+    previous_end = 0
+    for node in nodes:
+        if min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])]) <= previous_end:
+            return True
+        previous_end = node.end_lineno
+    return False
+
+
+def merge_duplicate_classes(code):
+    """
+    Merge the classes defined several times (typically one class per generated method) into the first definition.
+    Members defined several times keep their last version, as Python would, but members that only
+    the earlier definitions have are no longer lost.
+    """
+    tree = ast.parse(code)
+    lines = code.splitlines()
+    groups = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            groups.setdefault(node.name, []).append(node)
+
+    replacements = []
+    for name, nodes in groups.items():
+        if len(nodes) < 2:
+            continue
+        members = {}
+        others = []
+        for node in nodes:
+            use_source = not _shares_lines(node.body) and node.body[0].lineno > node.lineno
+            for stmt in node.body:
+                text = _segment(lines, stmt) if use_source else ast.unparse(stmt)
+                key = _member_key(stmt)
+                if key is None:
+                    if text.strip() not in ('pass', '...') and text not in others:
+                        others.append(text)
+                else:
+                    members[key] = text
+        # a fragment adding a method usually repeats the class without its bases
+        declared = next((node for node in nodes if node.bases or node.keywords), nodes[0])
+        decorated = next((node for node in nodes if node.decorator_list), nodes[0])
+        header = ast.unparse(ast.ClassDef(name=name, bases=declared.bases, keywords=declared.keywords,
+                                          body=[ast.Pass()], decorator_list=decorated.decorator_list)).splitlines()
+        body = list(members.values()) + others
+        if '__doc__' in members:
+            body.remove(members['__doc__'])
+            body.insert(0, members['__doc__'])
+        merged = '\n'.join(header[:-1]) + '\n' + '\n\n'.join(textwrap.indent(text, '    ') for text in body)
+        for i, node in enumerate(nodes):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            replacements.append((start, node.end_lineno, merged if i == 0 else None))
+
+    for start, end, text in sorted(replacements, reverse=True):
+        if text is None:
+            # drop the blank lines that separated the removed duplicate from what follows
+            while end < len(lines) and not lines[end].strip():
+                end += 1
+        lines[start - 1:end] = text.splitlines() if text is not None else []
+    return '\n'.join(lines) + '\n'
+
+
+def hoist_imports(code):
+    """
+    Move every module level import to the top of the code, once each, after the module docstring and __future__ imports.
+    """
+    tree = ast.parse(code)
+    lines = code.splitlines()
+    body = tree.body
+    docstring_end = 0
+    if body and _member_key(body[0]) == '__doc__':
+        docstring_end = body[0].end_lineno
+        body = body[1:]
+    if _shares_lines(body):
+        return code
+
+    future, imports, seen, removed = [], [], set(), []
+    for node in body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        removed.append((node.lineno, node.end_lineno))
+        target = future if getattr(node, 'module', None) == '__future__' else imports
+        aliases = []
+        for alias, (bound, origin) in zip(node.names, _import_bindings(node)):
+            if (bound, origin) not in seen:
+                seen.add((bound, origin))
+                aliases.append(alias)
+        if aliases:
+            node.names = aliases
+            target.append(ast.unparse(node))
+    if not removed:
+        return code
+
+    for start, end in sorted(removed, reverse=True):
+        lines[start - 1:end] = []
+    # keep a shebang or encoding line first
+    header_end = docstring_end
+    while header_end < min(2, len(lines)) and re.match(r"#!|#.*coding[:=]", lines[header_end]):
+        header_end += 1
+    rest = '\n'.join(lines[header_end:]).strip('\n')
+    parts = ['\n'.join(lines[:header_end]).strip('\n'), '\n'.join(future + imports), rest]
+    return '\n\n'.join(part for part in parts if part) + '\n'
+
+
+def fix_code(code):
+    """
+    Apply the cheap, deterministic fixes: merge duplicate classes, hoist and deduplicate imports.
+    Code that does not parse is returned unchanged.
+    """
+    try:
+        ast.parse(code)
+    except (SyntaxError, ValueError):
+        return code
+    return hoist_imports(merge_duplicate_classes(code))
+
+
+def failures(diagnostics):
+    """
+    The diagnostics that need a real repair: errors, as fix_code handles the warnings it can.
+    """
+    return [d for d in diagnostics if d['severity'] == 'error']
+
+
+def format_diagnostics(diagnostics):
+    lines = []
+    for d in diagnostics:
+        where = f"line {d['lineno']}" if d['lineno'] is not None else "module"
+        if d['symbol']:
+            where += f" ({d['symbol']})"
+        lines.append(f"{where}: {d['message']}")
+    return '\n'.join(lines)
+
+
+def gate(code, context='', known_names=()):
+    """
+    Fix what can be fixed locally and return the fixed code with the remaining real failures,
+    the only ones worth an LLM repair call.
+    """
+    fixed = fix_code(code)
+    return fixed, failures(check_code(fixed, context, known_names))
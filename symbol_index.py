@@ -0,0 +1,157 @@
+import ast
+import hashlib
+import re
+
+import numpy as np
+
+
+def words(text):
+    """
+    Lowercased words of a text, identifiers also split on snake_case and CamelCase.
+    """
+    result = []
+    for identifier in re.findall(r"[A-Za-z_][A-Za-z0-9_]*", text):
+        parts = re.findall(r"[A-Z]+(?=[A-Z][a-z]|\b|_|\d)|[A-Z]?[a-z]+|[A-Z]+|\d+", identifier)
+        result.append(identifier.lower())
+        if len(parts) > 1:
+            result.extend(part.lower() for part in parts)
+    return result
+
+
+def top_level_symbols(code):
+    """
+    Map the module level classes and functions of the code to their source.
+    """
+    lines = code.splitlines()
+    symbols = {}
+    for node in ast.parse(code).body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            symbols[node.name] = '\n'.join(lines[start - 1:node.end_lineno])
+    return symbols
+
+
+class SymbolIndex:
+    """
+    Retrieval index over the symbols of a program: hashed bag of words vectors in a NumPy matrix,
+    ranked by the cosine similarity of their TF-IDF weighted vectors. Symbols are added, updated
+    and removed one by one; the IDF weights are applied at query time, so they never go stale.
+    """
+
+    def __init__(self, dim=2048, capacity=256):
+        self.dim = dim
+        self.counts = np.zeros((capacity, dim), dtype=np.float32)  # sublinear term frequencies
+        self.squares = np.zeros((capacity, dim), dtype=np.float32)  # their squares, for the norms
+        self.document_frequency = np.zeros(dim, dtype=np.float32)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.rows = {}
+        self.names = [None] * capacity
+        self.hashes = {}
+        self.sources = {}
+        self.free_rows = list(range(capacity - 1, -1, -1))
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in words(text):
+            vector[int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), 'big') % self.dim] += 1
+        np.log1p(vector, out=vector)
+        return vector
+
+    def _grow(self):
+        capacity = len(self.names)
+        self.counts = np.vstack([self.counts, np.zeros_like(self.counts)])
+        self.squares = np.vstack([self.squares, np.zeros_like(self.squares)])
+        self.active = np.concatenate([self.active, np.zeros(capacity, dtype=bool)])
+        self.names.extend([None] * capacity)
+        self.free_rows.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def add(self, name, source):
+        """
+        Add or update a symbol. Unchanged symbols cost only a hash.
+        """
+        digest = hashlib.sha1(source.encode()).hexdigest()
+        if self.hashes.get(name) == digest:
+            return
+        self.remove(name)
+        if not self.free_rows:
+            self._grow()
+        row = self.free_rows.pop()
+        vector = self._vector(source)
+        self.counts[row] = vector
+        self.squares[row] = vector * vector
+        self.document_frequency += vector > 0
+        self.active[row] = True
+        self.rows[name] = row
+        self.names[row] = name
+        self.hashes[name] = digest
+        self.sources[name] = source
+
+    def remove(self, name):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        self.document_frequency -= self.counts[row] > 0
+        self.counts[row] = 0
+        self.squares[row] = 0
+        self.active[row] = False
+        self.names[row] = None
+        self.free_rows.append(row)
+        del self.hashes[name], self.sources[name]
+
+    def sync(self, code):
+        """
+        Bring the index up to date with the module level symbols of the code, if it parses.
+        """
+        try:
+            symbols = top_level_symbols(code)
+        except SyntaxError:
+            return
+        for name in [name for name in self.rows if name not in symbols]:
+            self.remove(name)
+        for name, source in symbols.items():
+            self.add(name, source)
+
+    def query_many(self, texts, k=5):
+        """
+        The names and similarities of the k symbols most similar to each text, all texts ranked in one product.
+        """
+        if not self.rows:
+            return [[] for _ in texts]
+        idf = np.log((1 + len(self.rows)) / (1 + self.document_frequency)) + 1
+        queries = np.stack([self._vector(text) * idf for text in texts])
+        scores = self.counts @ (queries * idf).T
+        norms = np.sqrt(self.squares @ (idf * idf))[:, None] * np.linalg.norm(queries, axis=1)[None, :]
+        scores = np.where(self.active[:, None] & (norms > 0), scores / np.maximum(norms, 1e-12), -1.0)
+        k = min(k, len(self.rows))
+        results = []
+        for column in scores.T:
+            best = np.argpartition(-column, k - 1)[:k]
+            best = best[np.argsort(-column[best])]
+            results.append([(self.names[row], float(column[row])) for row in best if column[row] > 0])
+        return results
+
+    def query(self, text, k=5):
+        return self.query_many([text], k)[0]
+
+
+def relevant_code(code, index, query, k=5, max_chars=12000):
+    """
+    The context to give with a task: the whole code while it is short, else its imports and module level
+    statements with only the k classes and functions most relevant to the query, in their original order.
+    """
+    if len(code) <= max_chars:
+        return code
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code
+    index.sync(code)
+    selected = {name for name, _ in index.query(query, k)}
+    lines = code.splitlines()
+    parts = []
+    for node in tree.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.name not in selected:
+            continue
+        start = min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])])
+        parts.append('\n'.join(lines[start - 1:node.end_lineno]))
+    return '\n\n'.join(parts)
@@ -0,0 +1,35 @@
+import json
+
+import estimate
+import utils
+
+
+def write_runs(path, runs):
+    with open(path, 'w') as file:
+        for run in runs:
+            file.write(json.dumps(dict(run, type='run', backend=utils.BACKEND)) + '\n')
+
+
+def test_runs_with_the_same_settings_fall_back_to_the_heuristic(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    write_runs(path, [{'calls': 10, 'prompt_tokens': 4000, 'completion_tokens': 1000, 'seconds': 1.0,
+                       'design_iterations': 2, 'improve_iterations': 2, 'performance_iterations': 0,
+                       'prompt_words': 5, 'tasks': 3}] * 9)
+    result = estimate.estimate('make an inventory of items', 2, 2, 0, str(path))
+    assert result['method'].startswith('heuristic')
+    assert result['calls'] > 0
+
+
+def test_runs_varying_in_every_feature_are_regressed(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    runs = []
+    for index in range(9):
+        settings = {'design_iterations': index % 3, 'improve_iterations': index % 4,
+                    'performance_iterations': index % 2, 'prompt_words': 5 + index * index, 'tasks': 2 + index % 5}
+        calls = 2 + 2 * settings['design_iterations'] + settings['tasks'] + 2 * settings['improve_iterations']
+        runs.append(dict(settings, calls=calls, prompt_tokens=1000 * calls, completion_tokens=300 * calls,
+                         seconds=float(calls)))
+    write_runs(path, runs)
+    result = estimate.estimate('make an inventory of items', 2, 2, 0, str(path))
+    assert result['method'] == 'regression over 9 runs'
+    assert result['calls'] > 0
@@ -0,0 +1,12 @@
+import improve_generator_itself
+import utils
+
+
+def test_propose_candidate_reads_back_files_with_fences(monkeypatch):
+    sources = {'utils.py': 'PATTERN = "```python"\n\ndef f():\n    return "```"\n',
+               'generate_code.py': 'import utils\n'}
+    answer = 'Here is the new version:\n\n' + '\n\n'.join(
+        f"{improve_generator_itself.FILE_START.format(name=name)}\n{code}"
+        f"{improve_generator_itself.FILE_END.format(name=name)}" for name, code in sources.items())
+    monkeypatch.setattr(utils, 'chat_with_gpt', lambda *args, **kwargs: answer)
+    assert improve_generator_itself.propose_candidate(sources, {}, 'gpt-4o') == sources
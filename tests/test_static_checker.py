@@ -0,0 +1,61 @@
+import static_checker
+
+
+def test_hoist_imports_keeps_submodule_imports():
+    code = ("import xml\n"
+            "def tag():\n"
+            "    return xml.etree.ElementTree.fromstring('<a/>').tag\n"
+            "import xml.etree.ElementTree\n")
+    hoisted = static_checker.hoist_imports(code)
+    assert hoisted.startswith("import xml\nimport xml.etree.ElementTree\n")
+    namespace = {}
+    exec(hoisted, namespace)
+    assert namespace['tag']() == 'a'
+
+
+def test_hoist_imports_drops_repeated_imports():
+    code = "import os\nx = os.sep\nimport os\ny = os.sep\n"
+    assert static_checker.hoist_imports(code).count("import os") == 1
+
+
+def test_submodule_import_is_not_a_duplicate():
+    code = "import logging\nimport logging.handlers\nlogging.handlers.QueueHandler\n"
+    kinds = [d['kind'] for d in static_checker.check_code(code)]
+    assert 'duplicate-import' not in kinds
+
+
+def test_merge_duplicate_classes_keeps_the_declared_bases():
+    code = ("class Entity:\n"
+            "    def __init__(self):\n"
+            "        self.x = 0\n"
+            "\n"
+            "class Game(Entity):\n"
+            "    def __init__(self):\n"
+            "        super().__init__()\n"
+            "\n"
+            "class Game:\n"
+            "    def position(self):\n"
+            "        return self.x\n")
+    merged = static_checker.merge_duplicate_classes(code)
+    assert "class Game(Entity):" in merged
+    assert merged.count("class Game") == 1
+    namespace = {}
+    exec(merged, namespace)
+    assert namespace['Game']().position() == 0
+
+
+def test_method_fragment_sees_the_attributes_of_the_context():
+    context = "class Game:\n    def __init__(self):\n        self.score = 0\n"
+    fragment = "class Game:\n    def get_score(self):\n        return self.score + self.bonus\n"
+    messages = [d['message'] for d in static_checker.check_code(fragment, context=context)
+                if d['kind'] == 'unknown-attribute']
+    assert messages == ["'Game' has no attribute 'bonus'"]
+
+
+def test_gate_keeps_valid_code_runnable():
+    code = "import xml\nimport xml.etree.ElementTree\nTAG = xml.etree.ElementTree.fromstring('<a/>').tag\n"
+    gated, failures = static_checker.gate(code)
+    assert not failures
+    namespace = {}
+    exec(gated, namespace)
+    assert namespace['TAG'] == 'a'
@@ -0,0 +1,27 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+
+
+def test_concurrent_runs_count_only_their_own_calls(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'BACKEND', 'mock')
+    monkeypatch.setattr(utils, 'TRACE_PATH', str(tmp_path / 'traces.jsonl'))
+    counters = {}
+
+    @utils.own_context
+    def run(name, calls):
+        counters[name] = utils.CallCounter()
+        utils.count_calls(counters[name])
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(utils.in_context(lambda _: utils.chat_with_gpt('print(1)', 'gpt-4o', 'improve_code')),
+                              range(calls)))
+
+    threads = [threading.Thread(target=run, args=(name, calls)) for name, calls in [('a', 3), ('b', 5)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counters['a'].totals['calls'] == 3
+    assert counters['b'].per_model()['gpt-4o']['calls'] == 5
+    assert utils.call_counters.get() == ()
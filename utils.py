@@ -1,35 +1,233 @@
-import openai
-import openai_apikey
 import json
 import ast
+import contextvars
+import functools
 import re
 import os
-# Set up the OpenAI API key
-openai.api_key = openai_apikey.api_key
-assert openai.api_key != "your_api_key", "Please set your OpenAI API key in the `openai.api_key` variable"
+import glob
+import hashlib
+import difflib
+import threading
+import time
+import metrics
+import mock_backend
+import prompt_cache
+import prompts
 
 def make_directory(folder_name):
     if not os.path.exists(folder_name):
-        os.mkdir(folder_name)
+        os.makedirs(folder_name)
 
-def chat_with_gpt(prompt, model):
+# the backend answering the calls: "openai", or "mock" for offline runs such as the generator benchmarks
+BACKEND = os.environ.get("CODE4ME_BACKEND", "openai")
+# calls and tokens used since the start of the process
+call_stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+call_stats_lock = threading.Lock()
+
+class CallCounter:
+    """
+    Calls and tokens of the calls counted by it, such as those of one run (see count_calls), in total and per model.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.models = {}
+
+    def add(self, model, prompt_tokens, completion_tokens):
+        with self.lock:
+            for stats in (self.totals, self.models.setdefault(model, dict.fromkeys(self.totals, 0))):
+                stats["calls"] += 1
+                stats["prompt_tokens"] += prompt_tokens
+                stats["completion_tokens"] += completion_tokens
+
+    def per_model(self):
+        with self.lock:
+            return {model: dict(stats) for model, stats in self.models.items()}
+
+# the counters of the calls made in the current context: concurrent runs, in threads of the daemon or
+# in the parallel modules of a hierarchical run, each count only their own calls
+call_counters = contextvars.ContextVar("call_counters", default=())
+
+def count_calls(*counters):
+    """
+    Count the calls made from now on in the current context, and in the threads it starts with in_context,
+    with the counters too.
+    """
+    current = call_counters.get()
+    call_counters.set(current + tuple(counter for counter in counters if counter not in current))
+
+def in_context(function):
+    """
+    The function, run in a copy of the current context, for a thread pool to count the calls of the task
+    for the run that submitted it.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return run
+
+def own_context(function):
+    """
+    Decorator running each call of the function in a copy of the context of its caller, so that the counters
+    it adds with count_calls are left behind when it returns.
+    """
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        return contextvars.copy_context().run(function, *args, **kwargs)
+    return run
+# where the caches persist between runs
+CACHE_DIR = os.environ.get("CODE4ME_CACHE_DIR", ".code4me_cache")
+# near-duplicate prompts of these stages reuse the response of a previous call
+SEMANTIC_CACHE_STAGES = {"designer", "critic_design"}
+# loaded on the first call of these stages, not when utils is imported
+loaded_semantic_cache = None
+semantic_cache_lock = threading.Lock()
+
+def semantic_cache():
+    """
+    The semantic cache of the process, loaded from the cache directory on first use.
+    """
+    global loaded_semantic_cache
+    with semantic_cache_lock:
+        if loaded_semantic_cache is None:
+            loaded_semantic_cache = prompt_cache.SemanticCache(path=os.path.join(CACHE_DIR, "semantic_cache.json"))
+            metrics.gauge_callback("code4me_cache_hit_rate", loaded_semantic_cache.hit_rate, cache="semantic")
+    return loaded_semantic_cache
+# every call and every run is appended to the traces, the estimates of future runs are fitted on them
+TRACE_PATH = os.path.join(CACHE_DIR, "traces.jsonl")
+trace_lock = threading.Lock()
+
+def trace(record):
+    """
+    Append a record to the JSONL traces, with the backend and the time.
+    """
+    record = dict(record, backend=BACKEND, time=time.time())
+    with trace_lock:
+        make_directory(os.path.dirname(TRACE_PATH) or ".")
+        with open(TRACE_PATH, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+# the OpenAI client, imported and given its key on the first call to the API only,
+# so that importing utils is fast and works offline and without credentials
+openai = None
+openai_lock = threading.Lock()
+
+def openai_client():
+    """
+    The OpenAI client module, with the key of the OPENAI_API_KEY environment variable or else of openai_apikey.
+    """
+    global openai
+    with openai_lock:
+        if openai is None:
+            import openai as client
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if api_key is None:
+                import openai_apikey
+                api_key = openai_apikey.api_key
+            assert api_key != "your_api_key", "Please set your OpenAI API key in the `openai.api_key` variable"
+            client.api_key = api_key
+            openai = client
+    return openai
+
+# the sampling parameters of the calls that can be set, per stage
+SAMPLING_KEYS = ("temperature", "seed", "top_p", "max_tokens")
+# the sampling of the deterministic mode: the same prompt gets the same answer, as far as the provider allows
+DETERMINISTIC_SAMPLING = {"temperature": 0, "top_p": 1, "seed": 1234}
+
+def deterministic_sampling(sampling=None):
+    """
+    Pin the sampling of every stage to the deterministic one, keeping the max_tokens set.
+    The sampling is a dict of the parameters of each stage, and of "default" for the stages not listed.
+    """
+    sampling = sampling or {}
+    return {stage: dict(parameters, **DETERMINISTIC_SAMPLING)
+            for stage, parameters in dict({"default": {}}, **sampling).items()}
+
+def stage_sampling(sampling, stage):
+    """
+    The sampling parameters of a stage, those of "default" overridden by those of the stage, unset ones left out.
+    """
+    sampling = sampling or {}
+    parameters = dict(sampling.get("default", {}), **sampling.get(stage, {}))
+    return {key: parameters[key] for key in SAMPLING_KEYS if parameters.get(key) is not None}
+
+def chat_with_gpt(prompt, model, stage=None, sampling=None, variant=None, cache_key=None):
     """
     Interact with ChatGPT to get a response for a given prompt.
+    The stage names the step of the pipeline making the call, the mock backend answers according to it.
+    The sampling parameters of the stage are sent with the call, and are part of the cache key and of the trace.
+    The variant tells apart the prompts of a stage that are alike but must not share cached answers.
+    The cache key is the part of the prompt that changes from call to call, such as the user's goal: near-duplicate
+    prompts are matched on it only, the instructions around it would make any two prompts of a stage look alike.
     """
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant for programming tasks in Python."},
-            {"role": "user", "content": prompt},
-        ]
-    )
-    return response['choices'][0]['message']['content']
+    parameters = stage_sampling(sampling, stage)
+    cached = stage in SEMANTIC_CACHE_STAGES
+    if cached:
+        namespace = f"{stage}/{model}/{json.dumps(parameters, sort_keys=True)}/{variant or ''}"
+        content = semantic_cache().lookup(cache_key or prompt, namespace)
+        if content is not None:
+            return content
+    shared_prefix = prompts.prefix_report.record(stage, prompt)
+    start = time.monotonic()
+    metrics.inc("code4me_calls_in_flight")
+    try:
+        if BACKEND == "mock":
+            content = mock_backend.respond(stage, prompt)
+            usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+        else:
+            response = openai_client().ChatCompletion.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant for programming tasks in Python."},
+                    {"role": "user", "content": prompt},
+                ],
+                **parameters
+            )
+            content = response['choices'][0]['message']['content']
+            usage = response.get('usage', {})
+    except Exception:
+        metrics.inc("code4me_call_errors_total", stage=stage)
+        raise
+    finally:
+        metrics.inc("code4me_calls_in_flight", -1)
+    latency = time.monotonic() - start
+    metrics.inc("code4me_calls_total", stage=stage, model=model)
+    metrics.inc("code4me_tokens_total", usage.get("prompt_tokens", 0), kind="prompt")
+    metrics.inc("code4me_tokens_total", usage.get("completion_tokens", 0), kind="completion")
+    metrics.observe("code4me_call_latency_seconds", latency, stage=stage)
+    with call_stats_lock:
+        call_stats["calls"] += 1
+        call_stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        call_stats["completion_tokens"] += usage.get("completion_tokens", 0)
+    for counter in call_counters.get():
+        counter.add(model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+    trace({"type": "call", "stage": stage, "model": model, "prompt_tokens": usage.get("prompt_tokens", 0),
+           "completion_tokens": usage.get("completion_tokens", 0), "latency": latency, "sampling": parameters,
+           "shared_prefix": shared_prefix})
+    if cached:
+        semantic_cache().store(cache_key or prompt, content, namespace)
+    return content
+
+def throttle(seconds):
+    """
+    Wait between calls to stay under the API rate limits, which the mock backend does not have.
+    """
+    if BACKEND != "mock":
+        time.sleep(seconds)
+        metrics.inc("code4me_rate_limit_wait_seconds_total", seconds)
 
 
-def designer(initial_prompt, model):
+def designer(initial_prompt, model, starting_design=None, sampling=None, variant=None):
     """
     Use ChatGPT to break down the goal into subproblems.
+    With a starting design, the design of a similar program is adapted instead.
+    The design of a near-duplicate goal of the same variant may be reused.
     """
+    if starting_design is not None:
+        return adapt_design(initial_prompt, starting_design, model, sampling)
     breakdown_prompt = (
     f"Decompose the following programming task into a datastructure problem and associated list of subproblems. "
     f"You can use both classes and functions. Each subproblem should describe a single Python function or method within a class"
@@ -42,18 +240,67 @@ def designer(initial_prompt, model):
     f"The overall task is as follows:\n\n{initial_prompt}"
     )
 
-    response = chat_with_gpt(breakdown_prompt, model)
+    response = chat_with_gpt(breakdown_prompt, model, stage="designer", sampling=sampling, variant=variant,
+                             cache_key=initial_prompt)
+    return response
+
+def module_designer(initial_prompt, model, sampling=None):
+    """
+    Split a large program into modules with explicit interfaces, to generate each of them on its own.
+    """
+    module_prompt = (
+        f"Decompose the following programming task into Python modules that can be implemented independently. "
+        f"For each module, give its name (a valid Python module name), its purpose in a concise sentence, "
+        f"its interface, i.e. the list of the signatures of the classes, methods and functions it provides to the "
+        f"other modules, with the types of their parameters and return values, and the list of the modules it "
+        f"depends on. The module containing the main function to execute the program, called 'run', "
+        f"must be called 'main'.\n\n"
+        f"Provide the response as a list of dictionnaries with the keys 'module', 'purpose', 'interface' and "
+        f"'depends_on', starting with [ and ending with ], with no additional comments.\n\n"
+        f"The overall task is as follows:\n\n{initial_prompt}"
+    )
+
+    response = chat_with_gpt(module_prompt, model, stage="module_designer", sampling=sampling)
     return response
 
-def critic_design(initial_prompt, current_design, model):
+def adapt_design(initial_prompt, starting_design, model, sampling=None):
+    """
+    Adapt the design of a similar program to the goal, as a warm start for the design iterations.
+    """
+    adapt_prompt = (
+        f"You are a programmer tasked with designing a project, starting from the design of a similar project.\n\n"
+        f"The user's goal is as follows: \"{initial_prompt}\".\n\n"
+        f"The design of the similar project is:\n\n{starting_design}\n\n"
+        f"Adapt this design to the user's goal: keep the classes and functions that fit, "
+        f"modify or remove the ones that do not, and add whatever is missing. "
+        f"Each item must keep the same format: the function's purpose, the variables (with their types), "
+        f"and the expected return value, or for classes the detailed list of attributes and methods. "
+        f"The main function to execute the program should be called 'run'.\n\n"
+        f"Provide the response as a list of dictionnaries, starting with [ and ending with ], with no additional comments."
+    )
+
+    response = chat_with_gpt(adapt_prompt, model, stage="adapt_design", sampling=sampling)
+    return response
+
+def design_approved(critic):
+    """
+    Whether the critic found nothing to add to the design.
+    """
+    return "the design is okay as is" in critic.lower()
+
+def critic_design(initial_prompt, current_design, model, sampling=None, focus=None):
     """
     Use a critic to evaluate the alignment of the initial prompt with the current design.
+    With a focus, the critic looks at one aspect of the design in particular.
+    A critique is only reused for the very same design, never for a revision of it.
     """
+    focus_prompt = f"Focus your evaluation on {focus}.\n\n" if focus else ""
     critic_prompt = (
         f"You are a programming critic tasked with evaluating the design of a project.\n\n"
         f"The user's goal is as follows: \"{initial_prompt}\".\n\n"
         f"The current design is:\n\n{current_design}\n\n"
         f"Evaluate whether this design sufficiently addresses the user's goal.\n\n"
+        f"{focus_prompt}"
         f"If the design is complete and effectively decomposes the problem into smaller, manageable components, "
         f"respond only with 'the design is okay as is' and nothing else.\n\n"
         f"If the design is incomplete, provide a detailed list of additional functions, methods, or data structures "
@@ -65,11 +312,13 @@ def critic_design(initial_prompt, current_design, model):
         f"with no additional comments or explanations."
     )
 
-    response = chat_with_gpt(critic_prompt, model)
+    design_hash = hashlib.sha256(current_design.encode()).hexdigest()
+    response = chat_with_gpt(critic_prompt, model, stage="critic_design", sampling=sampling,
+                             variant=f"{focus or ''}/{design_hash}", cache_key=initial_prompt)
     return response
 
 
-def concatenate_designs(design, critic, model):
+def concatenate_designs(design, critic, model, sampling=None):
     """
     Concatenate the initial design with the critic's suggestions.
     """
@@ -81,94 +330,86 @@ def concatenate_designs(design, critic, model):
         f"Ensure the following guidelines are met:\n"
         f"1. Eliminate any redundancy between the design and the feedback.\n"
         f"2. Return the final design in the same format as the original design, starting with [ and ending with ], with no additional comments.\n"
-        f"3. Reorder the elements as follows:\n"
-        f"   - Define all classes first, including their attributes and methods.\n"
-        f"   - Define functions afterward, ensuring that functions appear after any classes or other functions they depend on.\n"
-        f"4. Include necessary elements such as imports, global variables, and the main function (`run`) in the correct order.\n"
+        f"3. Include necessary elements such as imports, global variables, and the main function (`run`).\n"
     )
-    response = chat_with_gpt(concatenate_prompt, model)
+    response = chat_with_gpt(concatenate_prompt, model, stage="concatenate_designs", sampling=sampling)
     return response
 
-def class_coder(current_code, prompt, model):
+def class_coder(current_code, prompt, model, sampling=None):
     """
     Interact with ChatGPT to get a response for a given prompt.
     """
-    class_prompt = (
-        f"You are a programmer tasked with adding a new Python class to an existing codebase.\n\n"
-        f"The current code is as follows:\n{current_code}\n\n"
-        f"The new class to be implemented is described in the following JSON-like dictionary, which includes its name, description, "
-        f"attributes, and methods:\n{prompt}\n\n"
-        f"Your task is to:\n"
-        f"1. Add the new class to the provided codebase without modifying the existing code.\n"
-        f"2. Fully implement the class, including the `__init__` method and all described methods.\n"
-        f"3. Include inline comments or docstrings within the class to explain its purpose and functionality.\n\n"
-        f"Output requirements:\n"
-        f"- Only return the code for the new class without any additional comments or explanations outside the code.\n"
-        f"- Ensure proper formatting and indentation for Python code.\n"
-        f"- You cannot use placeholders such as 'add specific logic here'; "
-        f"you must fully implement the logic described in the class descriptor.\n"
-        f"dont be too much verbose"
-    )
-
-    response = chat_with_gpt(class_prompt, model)
+    class_prompt = prompts.render(prompts.CLASS_CODER,
+                                  context=[("The current code is as follows", current_code)],
+                                  delta=[("The new class to be implemented is", prompt)])
+    response = chat_with_gpt(class_prompt, model, stage="class_coder", sampling=sampling)
     return response
 
 
-def function_coder(current_code, prompt, model):
+def function_coder(current_code, prompt, model, sampling=None):
     """
     Interact with ChatGPT to get a response for a given prompt.
     """
-    function_prompt = (
-        f"You are a programmer tasked with adding a new Python function or method to an existing codebase.\n\n"
-        f"The current code is as follows:\n{current_code}\n\n"
-        f"The task is to:\n"
-        f"1. Implement a function or method that achieves the following goal:\n{prompt}\n"
-        f"2. Add the function or method to the existing code without modifying the current code.\n"
-        f"3. If the function is part of a class, ensure it is correctly formatted and indented as a method within the class.\n\n"
-        f"Output requirements:\n"
-        f"- Only return the code for the new function or method, with no additional comments or explanations outside the code.\n"
-        f"- Ensure proper formatting and indentation for Python code.\n"
-        f"- Include inline comments or a docstring to describe the function's purpose and behavior.\n"
-        f"- Fully implement the logic for the function; avoid placeholders like 'add specific logic here."
-        f"dont be too much verbose'\n"
-    )
-
-    response = chat_with_gpt(function_prompt, model)
+    function_prompt = prompts.render(prompts.FUNCTION_CODER,
+                                     context=[("The current code is as follows", current_code)],
+                                     delta=[("The goal of the new function or method is", prompt)])
+    response = chat_with_gpt(function_prompt, model, stage="function_coder", sampling=sampling)
     return response
 
 
-def improve_code(initial_prompt, current_code, model):
+def improve_code(initial_prompt, current_code, model, sampling=None):
     """
     Use a critic to evaluate the alignment of the initial prompt with the current code.
     """
-    improve_prompt = (
-        f"You are a critic tasked with improving a codebase to better achieve a programming goal.\n\n"
-        f"The user's goal is as follows:\n\"{initial_prompt}\"\n\n"
-        f"The current code is as follows:\n{current_code}\n\n"
-        f"Your task is to:\n"
-        f"1. Rewrite the code to improve its overall quality, readability, and effectiveness in achieving the specified goal.\n"
-        f"2. You may:\n"
-        f"   - Reorganize the code, changing the order of classes, functions, or methods if needed.\n"
-        f"   - Add new functions, methods, or classes to enhance functionality.\n"
-        f"   - Remove redundant or unnecessary parts of the code.\n"
-        f"   - Fully implement any methods or functions that are currently incomplete.\n"
-        f"3. Ensure the code is well-structured and adheres to Python best practices.\n"
-        f"4. Include inline comments or docstrings to explain the purpose and functionality of classes, functions, or methods where relevant.\n\n"
-        f"Output requirements:\n"
-        f"- Return only the improved code, with no additional comments or explanations outside the code.\n"
-        f"- Ensure proper formatting, indentation, and a clear, logical flow in the final output.\n"
-    )
+    improve_prompt = prompts.render(prompts.IMPROVE_CODE,
+                                    context=[("The user's goal is as follows", f'"{initial_prompt}"')],
+                                    delta=[("The current code is as follows", current_code)])
+    response = chat_with_gpt(improve_prompt, model, stage="improve_code", sampling=sampling)
+    return response
+
 
-    response = chat_with_gpt(improve_prompt, model)
+def workload_writer(initial_prompt, current_code, model, sampling=None):
+    """
+    Ask for a script exercising the main code paths of the program, to profile it.
+    """
+    workload_prompt = prompts.render(prompts.WORKLOAD_WRITER,
+                                     context=[("The user's goal for the program is as follows", f'"{initial_prompt}"')],
+                                     delta=[("The program is as follows", current_code)])
+    response = chat_with_gpt(workload_prompt, model, stage="workload_writer", sampling=sampling)
     return response
 
 
-def save_code_to_file(content, filepath):
+def improve_performance(initial_prompt, current_code, hotspots, model, sampling=None):
     """
-    Save content to a file.
+    Rewrite the code to make it faster, driven by the hotspots found by profiling it.
     """
-    with open(filepath, "a") as file:
-        file.write(content)
+    performance_prompt = prompts.render(prompts.IMPROVE_PERFORMANCE,
+                                        context=[("The user's goal is as follows", f'"{initial_prompt}"')],
+                                        delta=[("The current code is as follows", current_code),
+                                               ("The hotspots of the program are", hotspots)])
+    response = chat_with_gpt(performance_prompt, model, stage="improve_performance", sampling=sampling)
+    return response
+
+
+def repair_code(code, problems, model, context="", sampling=None):
+    """
+    Ask for a fix of the reported problems, on the failing code only.
+    The context gives the stubs of the definitions the code depends on, if any.
+    """
+    repair_prompt = prompts.render(prompts.REPAIR_CODE,
+                                   context=[("It relies on the following definitions, given as stubs", context)],
+                                   delta=[("The code is as follows", code),
+                                          ("The following problems were reported for this code", problems)])
+    response = chat_with_gpt(repair_prompt, model, stage="repair_code", sampling=sampling)
+    return response
+
+
+def save_code_to_file(content, filepath, mode="a"):
+    """
+    Save content to a file, appended by default.
+    """
+    with open(filepath, mode) as file:
+        file.write(content.strip("\n"))
         file.write("\n\n")
 
 def save_design_to_file(content, folder_name):
@@ -201,49 +442,115 @@ def erase_current_design(folder_name):
     with open(f"{folder_name}/generated_design.txt", "w") as file:
         file.write("")
 
+def erase_iterations(folder_name):
+    """
+    Remove the generated_code_iteration*.py files left by a previous run, since save_code_to_file appends.
+    """
+    for path in glob.glob(f"{folder_name}/generated_code_iteration*.py"):
+        os.remove(path)
+
+def normalize_code(code):
+    """
+    Return the structural form of the code as a list of lines: the AST is unparsed with docstrings removed,
+    so that formatting, comments and docstrings do not count as changes.
+    Falls back to the non blank, non comment source lines if the code does not parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        lines = [line.strip() for line in code.splitlines()]
+        return [line for line in lines if line and not line.startswith('#')]
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            body = node.body
+            if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+                    and isinstance(body[0].value.value, str):
+                node.body = body[1:] or [ast.Pass()]
+    return ast.unparse(tree).splitlines()
+
+def code_similarity(old_code, new_code):
+    """
+    Structural similarity between two versions of the code, from 0 (unrelated) to 1 (identical once normalized).
+    """
+    old_lines = normalize_code(old_code)
+    new_lines = normalize_code(new_code)
+    if old_lines == new_lines:
+        return 1.0
+    return difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).ratio()
+
+# a markdown code block: its opening fence with the language tag, up to its closing fence or the end of a cut answer
+# a block ends with a fence at the start of a line, or at the end of the last line of code
+CODE_BLOCK = re.compile(r"^[ \t]*```[ \t]*([\w+#.-]*)[^\n]*\n(.*?)(?:^[ \t]*```|```[ \t]*$|\Z)",
+                        re.MULTILINE | re.DOTALL)
+PYTHON_TAGS = {"python", "python3", "py"}
+
+def extract_code_blocks(text):
+    """
+    All the markdown code blocks of a text, in order, as (language tag lowercased, code) pairs, the tag empty if none.
+    """
+    return [(match.group(1).lower(), match.group(2).rstrip()) for match in CODE_BLOCK.finditer(text)]
+
 def parse_code_output(code_output):
     """
-    Parse the code output from the GPT-3 response.
+    Parse the code output from the GPT-3 response: the Python code blocks merged in order, else the untagged ones,
+    else the first block of any language, and the whole answer if it has no code block.
+    """
+    code_output = code_output if type(code_output) == str else str(code_output)
+    blocks = extract_code_blocks(code_output)
+    if not blocks:
+        return code_output.strip("\n")
+    for tags in (PYTHON_TAGS, {""}):
+        codes = [code for tag, code in blocks if tag in tags]
+        if codes:
+            return "\n\n".join(codes)
+    return blocks[0][1]
+
+# what the scanner of the answers stops at: quotes, brackets, escapes, line ends and markdown fences
+ANSWER_TOKENS = re.compile(r'"""|\'\'\'|```|\\.|["\'\[\](){}\n]', re.DOTALL)
+
+def array_spans(text):
+    """
+    Find the top-level arrays of a text in one pass: returns (fenced, start, end) for each balanced span
+    opened by a '[' outside any bracket, fenced if it is in a markdown code block. Strings are tracked
+    inside the brackets only, so that the apostrophes of the prose around do not count, and a one-quote
+    string still open at the end of its line is taken for prose too.
     """
-    if 'json' in code_output:
-        answer = str(code_output[7:-3])
-    elif 'python' in code_output:
-        answer = str(code_output[9:-3])
-    else:
-        answer = code_output if type(code_output) == str else str(code_output)
-    return answer
+    spans = []
+    depth, quote, start, fenced, in_fence = 0, None, None, False, False
+    for match in ANSWER_TOKENS.finditer(text):
+        token = match.group(0)
+        if quote is not None:
+            if token == quote or (token == "\n" and len(quote) == 1):
+                quote = None
+        elif depth == 0:
+            if token == "```":
+                in_fence = not in_fence
+            elif token == "[":
+                depth, start, fenced = 1, match.start(), in_fence
+        elif token in ('"', "'", '"""', "'''"):
+            quote = token
+        elif token in ("[", "(", "{"):
+            depth += 1
+        elif token in ("]", ")", "}"):
+            depth -= 1
+            if depth == 0:
+                spans.append((fenced, start, match.end()))
+    return spans
 
 def parse_answer(answer):
     """
     Parse the answer from the GPT-3 response, given that it should be of the form '["item1", "item2", ...]'.
-    This function just removes the brackets and tranform the str to a python list.
+    The list is the largest top-level array of the answer, preferably in a code block,
+    decoded as JSON or else as a Python literal.
     """
-    if 'json' in answer:
-        answer = str(answer[7:-3])
-    if 'python' in answer:
-        answer = str(answer[9:-3])
-    try:
-        return ast.literal_eval(answer)
-    except Exception as e:
-        print('trying other method') #dirty hacks here
-
-        input_text = answer
-        input_text = re.sub(r"'''(json|python)", "", input_text).strip("'''").strip()
+    for _, start, end in sorted(array_spans(answer), key=lambda span: (span[0], span[2] - span[1]), reverse=True):
+        candidate = answer[start:end]
         try:
-            return json.loads(input_text)
-        except json.JSONDecodeError:
+            return json.loads(candidate)
+        except ValueError:
             pass
         try:
-            return ast.literal_eval(input_text)
+            return ast.literal_eval(candidate)
         except (ValueError, SyntaxError):
             pass
-
-        match = re.search(r"\[.*\]", input_text, re.DOTALL)
-        if match:
-            try:
-                return ast.literal_eval(match.group(0))
-            except (ValueError, SyntaxError):
-                pass
-
-        # If all methods fail, return None or raise an error
-        raise ValueError("No valid list found in the input")
\ No newline at end of file
+    raise ValueError("No valid list found in the input")